@@ -25,12 +25,35 @@
 
 import obo
 import csv
+import io
+import itertools
 from optparse import OptionParser
 from sys import stdin, stderr, stdout
 from datetime import datetime
 from os import getenv
 
 
+BUFFER_SIZE = 1 << 20
+
+
+def _read_rows(f, delimiter, quote):
+    for line in f:
+        if quote in line:
+            # quoted fields need the full csv parser for the rest of the file
+            for row in csv.reader(itertools.chain((line,), f), delimiter=delimiter, quotechar=quote):
+                yield row
+            return
+        line = line.rstrip('\r\n')
+        if line == '':
+            yield []
+        else:
+            yield line.split(delimiter)
+
+
+def _no_column(filename, lineno, col):
+    stderr.write('%s:%d no column %d\n' % (filename, lineno, col))
+
+
 class CSV2OBO(OptionParser):
     def __init__(self):
         OptionParser.__init__(self, usage='usage: %prog [options] [files]')
@@ -45,6 +68,8 @@ class CSV2OBO(OptionParser):
         self.add_option('--quote', action='store', type='string', dest='quote', default='"', help='quote character (default: ")')
         self.add_option('--skip-first', action='store_true', dest='skip_first', default=False, help='skip first record (default: do not skip)')
         self.add_option('--output', action='store', type='str', dest='output', default=None, help='output file (default: standard output)')
+        self._name_table = str.maketrans({'[': '(', ']': ')'})
+        self._quote_table = str.maketrans({'"': '\''})
 
     def run(self):
         options, args = self.parse_args()
@@ -57,7 +82,7 @@ class CSV2OBO(OptionParser):
         if options.output is None:
             self.write(stdout)
         else:
-            with open(options.output, 'w') as f:
+            with open(options.output, 'w', buffering=BUFFER_SIZE) as f:
                 self.write(f)
 
     def init_ontology(self, options):
@@ -69,103 +94,95 @@ class CSV2OBO(OptionParser):
 
     def load(self, options, args):
         options.ignore_refs = set(options.ignore_refs)
+        if options.id_prefix is None:
+            self._get_ref = lambda ref: ref
+        else:
+            prefix = options.id_prefix + ':'
+            self._get_ref = lambda ref: ref if ':' in ref else prefix + ref
         if len(args) == 0:
             self.load_records(options, '<stdin>', stdin)
         else:
             for filename in args:
-                with open(filename) as f:
+                with open(filename, 'r', buffering=BUFFER_SIZE) as f:
                     self.load_records(options, filename, f)
 
     def load_records(self, options, filename, f):
-        r = csv.reader(f, delimiter=options.delimiter, quotechar=options.quote)
+        id_col = options.id_column
+        name_col = options.name_column
+        def_col = options.definition_column
+        isa_cols = tuple(options.isa_columns or ())
+        syn_cols = tuple(options.synonym_columns or ())
+        ignore = options.ignore_refs
+        skip_first = options.skip_first
+        ontology = self.ontology
+        name_tbl = self._name_table
+        quote_tbl = self._quote_table
+        max_col = max(col for col in (id_col, name_col, def_col) + isa_cols + syn_cols if col is not None)
+        get_ref = self._get_ref
+        SourcedValue = obo.SourcedValue
+        term_reader = obo.TermReader(filename, 0, ontology, obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn())
         lineno = 0
-        for row in r:
+        for row in _read_rows(f, options.delimiter, options.quote):
             lineno += 1
-            self.load_record(options, filename, lineno, row)
-
-    def load_record(self, options, filename, lineno, row):
-        if lineno == 1 and options.skip_first:
-            return
-        term_reader = obo.TermReader(filename, lineno, self.ontology, obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn())
-        if not self.read_id(options, row, term_reader):
-            return
-        self.read_name(options, row, term_reader)
-        self.read_def(options, row, term_reader)
-        self.read_isas(options, row, term_reader)
-        self.read_synonyms(options, row, term_reader)
-
-    @staticmethod
-    def column(filename, lineno, row, col):
-        if col >= len(row):
-            stderr.write('%s:%d no column %d\n' % (filename, lineno, col))
-            return ''
-        return row[col]
-
-    def read_id(self, options, row, term_reader):
-        id = CSV2OBO.column(term_reader.source, term_reader.lineno, row, options.id_column)
-        if id == '':
-            stderr.write('%s:%d id is empty\n' % (term_reader.source, term_reader.lineno))
-            return False
-        if id in options.ignore_refs:
-            stderr.write('%s:%d id is ignored (%s)\n' % (term_reader.source, term_reader.lineno, id))
-            return False
-        # stderr.write('id = %s\n' % id)
-        id = self.get_ref(options, id)
-        term_reader.read_id(obo.SourcedValue(term_reader.source, term_reader.lineno, id))
-        return True
-
-    def get_ref(self, options, ref):
-        if options.id_prefix is None:
-            return ref
-        if ref.find(':') >= 0:
-            return ref
-        return ':'.join((options.id_prefix, ref))
-
-    def read_name(self, options, row, term_reader):
-        name = CSV2OBO.column(term_reader.source, term_reader.lineno, row, options.name_column)
-        if name != '':
-            # stderr.write('name = %s\n' % name)
-            name = name.replace('[', '(').replace(']', ')')
-            term_reader.read_name(obo.SourcedValue(term_reader.source, term_reader.lineno, name))
-
-    def read_def(self, options, row, term_reader):
-        if options.definition_column is None:
-            return
-        definition = CSV2OBO.column(term_reader.source, term_reader.lineno, row, options.definition_column)
-        if definition != '':
-            # stderr.write('def = %s\n' % definition)
-            definition = definition.replace('"', '\'')
-            term_reader.read_def(obo.SourcedValue(term_reader.source, term_reader.lineno, '"%s" [%s]' % (definition, term_reader.stanza.id.value)))
-
-    def read_isas(self, options, row, term_reader):
-        if options.isa_columns is None:
-            return
-        for col in options.isa_columns:
-            ref = CSV2OBO.column(term_reader.source, term_reader.lineno, row, col)
-            ref = ref.split('/')[-2]  # taxid path hack
-            if ref == '':
+            if lineno == 1 and skip_first:
                 continue
-            if ref in options.ignore_refs:
-                stderr.write('%s:%d ref is ignored (%s)\n' % (term_reader.source, term_reader.lineno, ref))
+            # short rows are padded once, missing columns are still reported when they are read
+            width = len(row)
+            if width <= max_col:
+                row = row + [''] * (max_col + 1 - width)
+            if id_col >= width:
+                _no_column(filename, lineno, id_col)
+            id = row[id_col]
+            if id == '':
+                stderr.write('%s:%d id is empty\n' % (filename, lineno))
                 continue
-            ref = self.get_ref(options, ref)
-            term_reader.read_is_a(obo.SourcedValue(term_reader.source, term_reader.lineno, ref))
-
-    def read_synonyms(self, options, row, term_reader):
-        if options.synonym_columns is None:
-            return
-        for col in options.synonym_columns:
-            syn = CSV2OBO.column(term_reader.source, term_reader.lineno, row, col)
-            if syn != '':
-                syn = syn.replace('"', '\'')
-                term_reader.read_synonym(obo.SourcedValue(term_reader.source, term_reader.lineno, '"%s" [%s]' % (syn, term_reader.stanza.id.value)))
+            if id in ignore:
+                stderr.write('%s:%d id is ignored (%s)\n' % (filename, lineno, id))
+                continue
+            id = get_ref(id)
+            # one reader per file, reset for each record as OntologyReader does for stanzas
+            term_reader.lineno = lineno
+            term_reader.stanza = None
+            term_reader.read_id(SourcedValue(filename, lineno, id))
+            xref = ' [%s]' % term_reader.stanza.id.value
+            if name_col is not None:
+                if name_col >= width:
+                    _no_column(filename, lineno, name_col)
+                name = row[name_col]
+                if name != '':
+                    term_reader.read_name(SourcedValue(filename, lineno, name.translate(name_tbl)))
+            if def_col is not None:
+                if def_col >= width:
+                    _no_column(filename, lineno, def_col)
+                definition = row[def_col]
+                if definition != '':
+                    term_reader.read_def(SourcedValue(filename, lineno, '"%s"%s' % (definition.translate(quote_tbl), xref)))
+            for col in isa_cols:
+                if col >= width:
+                    _no_column(filename, lineno, col)
+                ref = row[col]
+                ref = ref.split('/')[-2]  # taxid path hack
+                if ref == '':
+                    continue
+                if ref in ignore:
+                    stderr.write('%s:%d ref is ignored (%s)\n' % (filename, lineno, ref))
+                    continue
+                term_reader.read_is_a(SourcedValue(filename, lineno, get_ref(ref)))
+            for col in syn_cols:
+                if col >= width:
+                    _no_column(filename, lineno, col)
+                syn = row[col]
+                if syn != '':
+                    term_reader.read_synonym(SourcedValue(filename, lineno, '"%s"%s' % (syn.translate(quote_tbl), xref)))
 
     def write(self, f):
-        self.ontology.write_obo(f)
+        buf = io.StringIO()
+        self.ontology.write_obo(buf)
         for term in self.ontology.iterterms():
             # stderr.write('id = %s\n' % term.id.value)
-            term.write_obo(f)
-        f.write('\n')
+            term.write_obo(buf)
+        buf.write('\n')
+        f.write(buf.getvalue())
 
 
 if __name__ == '__main__':
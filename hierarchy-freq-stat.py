@@ -23,10 +23,11 @@
 # SOFTWARE.
 
 from scipy.stats.distributions import chi2
+import numpy as np
 import obo
 import sys
-from collections import defaultdict
-from math import log
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from optparse import OptionParser
 
 EXPECTED = 0
@@ -39,21 +40,18 @@ def xlog(msg, *args):
     sys.stderr.write('\n')
 
 
-class Count:
-    def __init__(self):
-        self.proper = 0
-
-
 class Hierarchy:
     def __init__(self):
         self.node_map = {}
         self.root = None
+        self.proper = None
+        self.cumul = None
 
     def create_node(self, id, name, parent):
         if id in self.node_map:
             node = self.node_map[id]
         else:
-            node = Node(id, name)
+            node = Node(self, len(self.node_map), id, name)
             self.node_map[id] = node
         if parent is None:
             if self.root is not None:
@@ -63,63 +61,93 @@ class Hierarchy:
             parent.children.append(node)
         return node
 
-    def _obo_node(self, childrenmap, term, parent):
-        node = self.create_node(term.id.value, term.name.value, parent)
-        for child in childrenmap[term.id.value]:
-            self._obo_node(childrenmap, child, node)
-
     def read_obo(self, filename, rootid):
         onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), filename)
+        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), filename)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        childrenmap = defaultdict(list)
+        childrenmap = {}
         for term in onto.iterterms():
+            term.id.value = sys.intern(term.id.value)
             for par in term.parents():
-                childrenmap[par.id.value].append(term)
-        root = onto.stanzas[rootid]
-        self._obo_node(childrenmap, root, None)
+                childrenmap.setdefault(sys.intern(par.id.value), []).append(term)
+        stack = [(onto.stanzas[rootid], None)]
+        while stack:
+            term, parent = stack.pop()
+            node = self.create_node(term.id.value, term.name.value, parent)
+            for child in reversed(childrenmap.get(term.id.value, ())):
+                stack.append((child, node))
+        self.proper = np.zeros((len(FREQSETS), len(self.node_map)), dtype=np.int64)
+
+    def postorder(self):
+        '''Returns the nodes reachable from the root, each node after all its descendants'''
+        order = []
+        seen = set()
+        stack = [(self.root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                order.append(node)
+                continue
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.append((node, True))
+            for child in node.children:
+                if child not in seen:
+                    stack.append((child, False))
+        return order
+
+    def cumulate(self):
+        # a node's height is the length of the longest path to a leaf below it,
+        # so cumulating the edges by increasing parent height only reads final counts
+        height = np.zeros(len(self.node_map), dtype=np.int64)
+        parents = []
+        children = []
+        for node in self.postorder():
+            for child in node.children:
+                parents.append(node.idx)
+                children.append(child.idx)
+                height[node.idx] = max(height[node.idx], height[child.idx] + 1)
+        parents = np.array(parents, dtype=np.intp)
+        children = np.array(children, dtype=np.intp)
+        order = np.argsort(height[parents], kind='stable')
+        parents = parents[order]
+        children = children[order]
+        bounds = np.flatnonzero(np.diff(height[parents])) + 1
+        self.cumul = self.proper.copy()
+        for p, ch in zip(np.split(parents, bounds), np.split(children, bounds)):
+            np.add.at(self.cumul, (slice(None), p), self.cumul[:, ch])
 
     def read_frequencies(self, filename, c):
-        f = open(filename)
-        for line in f:
-            count, id = line.strip().split(None, 1)
-            if id in self.node_map:
-                self.node_map[id].counts[c].proper += int(count)
-        f.close()
+        with open(filename, 'r', buffering=1 << 20) as f:
+            rows = [line.split(None, 1) for line in f]
+        id_to_idx = dict((id, node.idx) for id, node in self.node_map.items())
+        idx = np.fromiter((id_to_idx.get(id.rstrip(), -1) for _, id in rows), dtype=np.intp, count=len(rows))
+        counts = np.array([count for count, _ in rows]).astype(np.int64)
+        known = idx >= 0
+        np.add.at(self.proper[c], idx[known], counts[known])
 
 
 class Node:
-    def __init__(self, id, name=''):
+    def __init__(self, hierarchy, idx, id, name=''):
+        self.hierarchy = hierarchy
+        self.idx = idx
         self.id = id
         self.name = name
-        self.counts = (Count(), Count())
         self.children = []
 
     def _write(self, f, indent=''):
-        f.write('%s%s (%d/%d)\n' % (indent, self.id, self.counts[EXPECTED].proper, self.counts[OBSERVED].proper))
+        f.write('%s%s (%d/%d)\n' % (indent, self.id, self.hierarchy.proper[EXPECTED, self.idx], self.hierarchy.proper[OBSERVED, self.idx]))
         indent = '  ' + indent
         for child in self.children:
             child._write(f, indent)
 
-    def cumulate(self, c=None):
-        if c is None:
-            for i in FREQSETS:
-                self.cumulate(i)
-            return
-        if hasattr(self.counts[c], 'cumul'):
-            return
-        r = self.counts[c].proper
-        for child in self.children:
-            child.cumulate(c)
-            r += child.counts[c].cumul
-        self.counts[c].cumul = r
-
     def observed(self):
-        return self.counts[OBSERVED].cumul
+        return self.hierarchy.cumul[OBSERVED, self.idx]
 
     def expected(self):
-        return self.counts[EXPECTED].cumul
+        return self.hierarchy.cumul[EXPECTED, self.idx]
 
 
 def delta_chi2(exp, obs):
@@ -127,65 +155,115 @@ def delta_chi2(exp, obs):
 
 
 def delta_g(exp, obs):
-    return 2 * obs * log(obs / exp)
-
-
-def delta_nil(exp, obs):
-    return 0
+    return 2 * obs * np.log(obs / exp)
 
 
 class Chi2Cell:
-    def __init__(self, ratio, deltafun, child):
+    def __init__(self, child, expected, observed, delta, pvalue=1.0):
         self.child = child
-        self.expected = ratio * child.expected()
-        self.observed = child.observed() + 1
-        self.delta = deltafun(self.expected, self.observed)
+        self.expected = expected
+        self.observed = observed
+        self.delta = delta
         self.direction = 0
-        self.pvalue = 1.0
+        self.pvalue = pvalue
 
     def set_direction(self):
-        if self.observed > self.expected:
-            self.direction = 1
-        elif self.observed == self.expected:
-            self.direction = 0
-        else:
-            self.direction = -1
-
+        # numpy booleans do not subtract, hence the int conversions
+        self.direction = int(self.observed > self.expected) - int(self.observed < self.expected)
+
+
+class ChildrenTest:
+    '''Chi-squared test of children counts, outliers are removed until the remaining children fit'''
+    def __init__(self, child_exp, child_obs):
+        self.child_exp = child_exp
+        self.child_obs = child_obs + 1
+        self.remaining = np.arange(len(child_exp))
+        self.esum = int(self.child_exp.sum())
+        self.osum = int(self.child_obs.sum())
+        self.records = []
+
+    def pending(self):
+        return len(self.remaining) >= 1
+
+    def compute(self, deltafun):
+        self.observed = self.child_obs[self.remaining]
+        ratio = float(self.osum) / float(self.esum)
+        self.expected = ratio * self.child_exp[self.remaining]
+        self.delta = deltafun(self.expected, self.observed)
+        return self.delta.sum(), len(self.remaining) - 1
 
-def test_children_chi2(node, threshold, deltafun, depth=0):
-    children = tuple(child for child in node.children if child.expected() > 0)
-    result = []
-    while len(children) >= 1:
-        esum = sum(child.expected() for child in children)
-        osum = sum(child.observed() for child in children) + len(children)
-        ratio = float(osum) / float(esum)
-        cells = tuple(Chi2Cell(ratio, deltafun, child) for child in children)
-        dsum = sum(cell.delta for cell in cells)
-        pvalue = chi2.sf(dsum, len(cells) - 1)
+    def update(self, pvalue, threshold):
         if pvalue > threshold:
-            for cell in cells:
-                cell.pvalue = pvalue
-                result.append(cell)
-            break
-        maxdelta = max(cell.delta for cell in cells)
-        for cell in cells:
-            if cell.delta == maxdelta:
-                cell.pvalue = pvalue
-                cell.set_direction()
-                result.append(cell)
-        children = tuple(cell.child for cell in cells if cell.delta < maxdelta)
-    result.extend(Chi2Cell(1, delta_nil, child) for child in node.children if child.expected() == 0)
-    yield result
+            self.records.extend((i, self.expected[k], self.observed[k], self.delta[k], pvalue, False) for k, i in enumerate(self.remaining))
+            self.remaining = self.remaining[:0]
+            return
+        outliers = self.delta == self.delta.max()
+        for k in np.flatnonzero(outliers):
+            self.records.append((self.remaining[k], self.expected[k], self.observed[k], self.delta[k], pvalue, True))
+        removed = self.remaining[outliers]
+        self.esum -= int(self.child_exp[removed].sum())
+        self.osum -= int(self.child_obs[removed].sum())
+        self.remaining = self.remaining[~outliers]
+
+
+def run_tests(tests, threshold, deltafun):
+    # all tests advance in lockstep so that each round needs a single chi2.sf call
+    pending = [t for t in tests if t.pending()]
+    while pending:
+        stats = [t.compute(deltafun) for t in pending]
+        pvalues = chi2.sf(np.array([dsum for dsum, _ in stats]), np.array([df for _, df in stats]))
+        for t, pvalue in zip(pending, pvalues):
+            t.update(pvalue, threshold)
+        pending = [t for t in pending if t.pending()]
+    return [t.records for t in tests]
+
+
+def _tested_nodes(node, depth):
+    yield node
     if depth > 0:
         for child in node.children:
-            for r in test_children_chi2(child, threshold, deltafun, depth - 1):
-                yield r
+            for n in _tested_nodes(child, depth - 1):
+                yield n
+
+
+def _cells(node, children, records):
+    result = []
+    for i, expected, observed, delta, pvalue, outlier in records:
+        cell = Chi2Cell(children[i], expected, observed, delta, pvalue)
+        if outlier:
+            cell.set_direction()
+        result.append(cell)
+    result.extend(Chi2Cell(child, 0, child.observed() + 1, 0) for child in node.children if child.expected() == 0)
+    return result
+
+
+def test_children_chi2(node, threshold, deltafun, depth=0, jobs=1):
+    nodes = list(_tested_nodes(node, depth))
+    unique_nodes = list(dict.fromkeys(nodes))
+    children = {}
+    tests = []
+    for n in unique_nodes:
+        idx = np.array([child.idx for child in n.children], dtype=np.intp)
+        cumul = n.hierarchy.cumul
+        tested = cumul[EXPECTED, idx] > 0
+        children[n] = tuple(child for child, t in zip(n.children, tested) if t)
+        tests.append(ChildrenTest(cumul[EXPECTED, idx[tested]], cumul[OBSERVED, idx[tested]]))
+    if jobs > 1:
+        records = [None] * len(tests)
+        with ProcessPoolExecutor(jobs) as executor:
+            for i, r in enumerate(executor.map(run_tests, [tests[i::jobs] for i in range(jobs)], repeat(threshold), repeat(deltafun))):
+                records[i::jobs] = r
+    else:
+        records = run_tests(tests, threshold, deltafun)
+    records = dict(zip(unique_nodes, records))
+    for n in nodes:
+        yield _cells(n, children[n], records[n])
 
 
 class HStat(OptionParser):
     def __init__(self):
         OptionParser.__init__(self, usage='usage: %prog --obo FILE --root ID --expected FILE --observed FILE [options]')
-        self.set_defaults(depth=0, deltafun=delta_chi2, risk=0.001)
+        self.set_defaults(depth=0, deltafun=delta_chi2, risk=0.001, jobs=1)
         self.add_option('--obo', action='store', type='string', dest='obo', help='hierarchy file in OBO format')
         self.add_option('--root', action='store', type='string', dest='root', help='identifier of the root node')
         self.add_option('--expected', action='store', type='string', dest='expected', help='expected frequencies (as given by uniq -c)')
@@ -193,6 +271,7 @@ class HStat(OptionParser):
         self.add_option('--depth', action='store', type='int', dest='depth', help='maximum depth of tested nodes (default: %default)')
         self.add_option('--g-test', action='store_const', const=delta_g, dest='deltafun', help='use G-test instead of regular chi-squared difference formula')
         self.add_option('--risk', action='store', type='float', dest='risk', help='null hypothesis rejection risk (default: %default)')
+        self.add_option('--jobs', action='store', type='int', dest='jobs', help='number of worker processes for the tests (default: %default)')
 
     def run(self):
         options, args = self.parse_args()
@@ -210,12 +289,12 @@ class HStat(OptionParser):
         hierarchy.read_obo(options.obo, options.root)
         hierarchy.read_frequencies(options.expected, EXPECTED)
         hierarchy.read_frequencies(options.observed, OBSERVED)
-        hierarchy.root.cumulate()
-        print('ID\tDIRECTION\tDELTA\tOBSERVED\tEXPECTED\tCHILD-EXPECTED\tP-VALUE\tNAME')
-        for cells in test_children_chi2(hierarchy.root, options.risk, options.deltafun, options.depth):
-            for cell in cells:
-                print('%s\t% 2d\t%15.6f\t%8d\t%15.6f\t%8d\t%f\t%s' % (cell.child.id, cell.direction, cell.delta, cell.observed, cell.expected, cell.child.expected(), cell.pvalue, cell.child.name))
-            print
+        hierarchy.cumulate()
+        out = sys.stdout
+        out.write('ID\tDIRECTION\tDELTA\tOBSERVED\tEXPECTED\tCHILD-EXPECTED\tP-VALUE\tNAME\n')
+        fmt = '%s\t% 2d\t%15.6f\t%8d\t%15.6f\t%8d\t%f\t%s\n'
+        for cells in test_children_chi2(hierarchy.root, options.risk, options.deltafun, options.depth, options.jobs):
+            out.write(''.join([fmt % (cell.child.id, cell.direction, cell.delta, cell.observed, cell.expected, cell.child.expected(), cell.pvalue, cell.child.name) for cell in cells]))
 
 
 if __name__ == '__main__':
@@ -23,10 +23,38 @@
 # SOFTWARE.
 
 from optparse import OptionParser
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
 import obo
+import os
 import sys
 
 
+_id_value = attrgetter('id.value')
+
+
+def _select(stanzas, ids):
+    # ids is usually empty, keep the stanza order otherwise
+    if not ids:
+        return ()
+    return tuple(p for p in stanzas if (_id_value(p) in ids))
+
+
+_ref_strings = {}
+
+
+def _format_ref(stanza):
+    # the same terms show up as parents, children and siblings of many diffs
+    r = _ref_strings.get(stanza)
+    if r is None:
+        r = _ref_strings[stanza] = '%s (%s)' % (stanza.id.value, stanza.name.value)
+    return r
+
+
+def _format_refs(stanzas):
+    return ', '.join([_format_ref(p) for p in stanzas])
+
+
 class TermDiff:
     def __init__(self, term1, term2):
         self.term1 = term1
@@ -45,22 +73,37 @@ class TermDiff:
             self.removed_siblings = ()
         else:
             self.name_change = (term1.name.value != term2.name.value)
-            syns1 = set(s.text for s in term1.synonyms)
-            syns2 = set(s.text for s in term2.synonyms)
+            syns1 = {s.text for s in term1.synonyms}
+            syns2 = {s.text for s in term2.synonyms}
             self.added_synonyms = syns2 - syns1
             self.removed_synonyms = syns1 - syns2
-            parentids1 = set(p.id.value for p in term1.parents())
-            parentids2 = set(p.id.value for p in term2.parents())
-            self.added_parents = tuple(p for p in term2.parents() if (p.id.value not in parentids1))
-            self.removed_parents = tuple(p for p in term1.parents() if (p.id.value not in parentids2))
-            childrenids1 = set(p.id.value for p in term1.children())
-            childrenids2 = set(p.id.value for p in term2.children())
-            self.added_children = tuple(p for p in term2.children() if (p.id.value not in childrenids1))
-            self.removed_children = tuple(p for p in term1.children() if (p.id.value not in childrenids2))
-            siblingids1 = set(s.id.value for p in term1.parents() for s in p.children())
-            siblingids2 = set(s.id.value for p in term2.parents() for s in p.children())
-            self.added_siblings = tuple(term2.ontology.stanzas[tid] for tid in siblingids2 if tid not in siblingids1)
-            self.removed_siblings = tuple(term1.ontology.stanzas[tid] for tid in siblingids1 if tid not in siblingids2)
+            parents1 = list(term1.parents())
+            parents2 = list(term2.parents())
+            children1 = list(term1.children())
+            children2 = list(term2.children())
+            parentids1 = set(map(_id_value, parents1))
+            parentids2 = set(map(_id_value, parents2))
+            self.added_parents = _select(parents2, parentids2 - parentids1)
+            self.removed_parents = _select(parents1, parentids1 - parentids2)
+            childrenids1 = set(map(_id_value, children1))
+            childrenids2 = set(map(_id_value, children2))
+            self.added_children = _select(children2, childrenids2 - childrenids1)
+            self.removed_children = _select(children1, childrenids1 - childrenids2)
+            if self.changed():
+                siblingids1 = {_id_value(s) for p in parents1 for s in p.children()}
+                siblingids2 = {_id_value(s) for p in parents2 for s in p.children()}
+                self.added_siblings = tuple(term2.ontology.stanzas[tid] for tid in siblingids2 if tid not in siblingids1)
+                self.removed_siblings = tuple(term1.ontology.stanzas[tid] for tid in siblingids1 if tid not in siblingids2)
+            else:
+                # siblings are only reported for changed terms, and they are the costliest to compute
+                self.added_siblings = ()
+                self.removed_siblings = ()
+        self._new_parents = _format_refs(self.added_parents)
+        self._former_parents = _format_refs(self.removed_parents)
+        self._new_children = _format_refs(self.added_children)
+        self._former_children = _format_refs(self.removed_children)
+        self._new_siblings = _format_refs(self.added_siblings)
+        self._former_siblings = _format_refs(self.removed_siblings)
 
     def changed(self):
         return self.deletion or self.addition or self.name_change or self.added_synonyms or self.removed_synonyms or self.added_parents or self.removed_parents or self.added_children or self.removed_children
@@ -94,22 +137,22 @@ class TermDiff:
         return ', '.join(self.removed_synonyms)
 
     def new_parents(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.added_parents)
+        return self._new_parents
 
     def former_parents(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.removed_parents)
+        return self._former_parents
 
     def new_children(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.added_children)
+        return self._new_children
 
     def former_children(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.removed_children)
+        return self._former_children
 
     def new_siblings(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.added_siblings)
+        return self._new_siblings
 
     def former_siblings(self):
-        return ', '.join(('%s (%s)' % (p.id.value, p.name.value)) for p in self.removed_siblings)
+        return self._former_siblings
 
 
 def _term_id(term):
@@ -124,10 +167,9 @@ def _build_name_dict(onto):
     result = {}
     for term in onto.iterterms():
         name = term.name.value
-        if name in result:
-            sys.stderr.write('terms with same name (%s): %s, %s\n' % (name, term.id.value, result[name].id.value))
-        else:
-            result[name] = term
+        first = result.setdefault(name, term)
+        if first is not term:
+            sys.stderr.write('terms with same name (%s): %s, %s\n' % (name, term.id.value, first.id.value))
     return result
 
 
@@ -169,12 +211,11 @@ class TermNameMatch(TermMatch):
 
     def _build_map(self, onto):
         result = {}
+        key = self._key
         for term in onto.iterterms():
-            name = self._key(term)
-            if name in result:
-                sys.stderr.write('terms with same name %s, %s\n' % (self._message(term), self._message(result[name])))
-            else:
-                result[name] = term
+            first = result.setdefault(key(term), term)
+            if first is not term:
+                sys.stderr.write('terms with same name %s, %s\n' % (self._message(term), self._message(first)))
         return result
 
     def _key(self, term):
@@ -189,21 +230,63 @@ class TermNameCaseMatch(TermNameMatch):
         return term.name.value.lower()
 
 
+def _intern_ids(onto):
+    intern = sys.intern
+    for stanza in onto.iter_user_stanzas():
+        stanza.id.value = intern(stanza.id.value)
+        for links in stanza.references.values():
+            for link in links:
+                link.reference = intern(link.reference)
+
+
+def _parse_onto(filename):
+    onto = obo.Ontology()
+    onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), filename)
+    onto.check_required()
+    onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
+    return onto
+
+
+def _load_onto(filename, cache_dir):
+    onto = obo.load_cached(cache_dir, (filename,), lambda: _parse_onto(filename))
+    # ids end up in the sets and dicts of every TermDiff
+    _intern_ids(onto)
+    onto.cache_hierarchy()
+    return onto
+
+
+def _fill_cache(filename, cache_dir):
+    _load_onto(filename, cache_dir)
+
+
 class OBODiff(OptionParser):
     def __init__(self):
         OptionParser.__init__(self, usage='usage: %prog [options]')
         self.set_defaults(term_match=TermIdMatch)
         self.add_option('--match-name', action='store_const', dest='term_match', const=TermNameMatch, help='match term names instead of ids')
         self.add_option('--match-name-case', action='store_const', dest='term_match', const=TermNameCaseMatch, help='match term names (case insensitive) instead of ids')
-
-    def _load_term_match(self, filename, klass):
-        onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), filename)
-        onto.check_required()
-        onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        return klass(onto)
+        self.add_option('--cache-dir', action='store', dest='cache_dir', default=None, help='cache parsed ontologies in this directory (default: no cache)')
+
+    def _id_differences(self, onto1, onto2):
+        stanzas2 = onto2.stanzas
+        common = onto1.stanzas.keys() & stanzas2.keys()
+        for term1 in onto1.iterterms():
+            id = term1.id.value
+            if id in common:
+                d = TermDiff(term1, stanzas2[id])
+                if d.changed():
+                    yield d
+            else:
+                yield TermDiff(term1, None)
+        for term2 in onto2.iterterms():
+            if term2.id.value not in common:
+                yield TermDiff(None, term2)
 
     def _differences(self, term_match1, term_match2):
+        if type(term_match1) is TermIdMatch and type(term_match2) is TermIdMatch:
+            for d in self._id_differences(term_match1.onto, term_match2.onto):
+                yield d
+            return
         for term1 in term_match1.onto.iterterms():
             term2 = term_match2.match(term1)
             d = TermDiff(term1, term2)
@@ -218,14 +301,20 @@ class OBODiff(OptionParser):
         options, args = self.parse_args()
         if len(args) != 2:
             raise Exception('two ontologies are required')
-        term_match1, term_match2 = (self._load_term_match(filename, options.term_match) for filename in args)
+        if options.cache_dir is not None:
+            missing = [fn for fn in args if not os.path.exists(obo.cache_path(options.cache_dir, (fn,)))]
+            if len(missing) > 1 and (os.cpu_count() or 1) > 1:
+                # parse concurrently, workers only fill the cache since sending back an ontology costs as much as parsing it
+                with ProcessPoolExecutor(len(missing)) as executor:
+                    list(executor.map(_fill_cache, missing, (options.cache_dir,) * len(missing)))
+        term_match1, term_match2 = (options.term_match(_load_onto(filename, options.cache_dir)) for filename in args)
         all_diff = tuple(self._differences(term_match1, term_match2))
         if not all_diff:
             sys.stderr.write('ontologies are equivalent\n')
         else:
-            print('ID\tNAME\tPRESENCE\tNEW NAME\tNEW SYNONYMS\tFORMER SYNONYMS\tNEW PARENTS\tFORMER PARENTS\tNEW CHILDREN\tFORMER CHILDREN\tNEW SIBLINGS\tFORMER SIBLINGS')
-            for diff in all_diff:
-                print('\t'.join((diff.id(), diff.name(), diff.presence(), diff.new_name(), diff.new_synonyms(), diff.former_synonyms(), diff.new_parents(), diff.former_parents(), diff.new_children(), diff.former_children(), diff.new_siblings(), diff.former_siblings())))
+            out = sys.stdout
+            out.write('ID\tNAME\tPRESENCE\tNEW NAME\tNEW SYNONYMS\tFORMER SYNONYMS\tNEW PARENTS\tFORMER PARENTS\tNEW CHILDREN\tFORMER CHILDREN\tNEW SIBLINGS\tFORMER SIBLINGS\n')
+            out.writelines(('\t'.join((diff.id(), diff.name(), diff.presence(), diff.new_name(), diff.new_synonyms(), diff.former_synonyms(), diff.new_parents(), diff.former_parents(), diff.new_children(), diff.former_children(), diff.new_siblings(), diff.former_siblings())) + '\n') for diff in all_diff)
 
 
 if __name__ == '__main__':
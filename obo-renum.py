@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
 
 # MIT License
 #
@@ -23,19 +23,37 @@
 # SOFTWARE.
 
 from optparse import OptionParser
+import io
 import obo
 import sys
 
 
-def _depth(term):
-    return len(list(term.ancestors()))
+# stanzas rendered in memory between two writes to standard output
+FLUSH_STANZAS = 10000
 
 
-def _cmp(t1, t2):
-    r = _depth(t1) - _depth(t2)
-    if r != 0:
-        return r
-    return obo.cmp(t1.name.value, t2.name.value)
+def _depths(terms):
+    # number of ancestors along every is_a path, as len(list(term.ancestors())), computed once per term
+    depths = {}
+    for term in terms:
+        stack = [term]
+        expanded = set()
+        while stack:
+            t = stack[-1]
+            if t in depths:
+                stack.pop()
+                continue
+            parents = [link.reference_object for link in t.references.get('is_a', ())]
+            missing = [p for p in parents if p not in depths]
+            if missing:
+                if t in expanded:
+                    raise obo.OBOException(t, 'cycle for %s (%s)?' % (t.id.value, t.name.value))
+                expanded.add(t)
+                stack.extend(missing)
+                continue
+            stack.pop()
+            depths[t] = sum((depths[p] + 1) for p in parents)
+    return depths
 
 
 class OBORenum(OptionParser):
@@ -46,33 +64,43 @@ class OBORenum(OptionParser):
         self.add_option('--start', action='store', type='int', default=0, dest='start', help='first number of generated identifier (default: %default)')
         self.add_option('--preserve', action='store_true', dest='preserve', default=False, help='preserve identifiers with the prefix')
         self.add_option('--mapping-file', action='store', dest='mapping_file', help='write identifier mapping in this file')
+        self.add_option('--cache-dir', action='store', dest='cache_dir', default=None, help='cache parsed ontologies in this directory (default: no cache)')
 
-    def run(self):
-        options, args = self.parse_args()
+    def _load_onto(self, filenames):
         onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
+        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *filenames)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
+        return onto
 
-        terms = [term for term in onto.iterterms() if not(isinstance(term, obo.BuiltinStanza) or term.source == '<<builtin>>')]
+    def run(self):
+        options, args = self.parse_args()
+        onto = obo.load_cached(options.cache_dir, args, lambda: self._load_onto(args))
+
+        user_stanzas = list(onto.iter_user_stanzas())
+        terms = [stanza for stanza in user_stanzas if isinstance(stanza, obo.Term)]
         if options.preserve:
             prefix = options.prefix + ':'
             terms = [term for term in terms if not(term.id.value.startswith(prefix))]
-        terms.sort(cmp=_cmp)
+        depths = _depths(terms)
+        terms.sort(key=lambda term: (depths[term], term.name.value))
         format = '%s:%%0%dd' % (options.prefix, options.digits)
         mapping = dict((term.id.value, format % n) for n, term in enumerate(terms, options.start))
 
-        onto.write_obo(sys.stdout)
-        for stanza in onto.stanzas.values():
-            if isinstance(stanza, obo.BuiltinStanza) or stanza.source == '<<builtin>>':
-                continue
-            if stanza.id.value in mapping:
-                stanza.id.value = mapping[stanza.id.value]
+        buf = io.StringIO()
+        onto.write_obo(buf)
+        get_id = mapping.get
+        for n, stanza in enumerate(user_stanzas, 1):
+            stanza.id.value = get_id(stanza.id.value, stanza.id.value)
             for links in stanza.references.values():
                 for link in links:
-                    if link.reference in mapping:
-                        link.reference = mapping[link.reference]
-            stanza.write_obo(sys.stdout)
+                    link.reference = get_id(link.reference, link.reference)
+            stanza.write_obo(buf)
+            if n % FLUSH_STANZAS == 0:
+                sys.stdout.write(buf.getvalue())
+                buf.seek(0)
+                buf.truncate()
+        sys.stdout.write(buf.getvalue())
 
         if options.mapping_file is not None:
             f = open(options.mapping_file, 'w')
@@ -24,47 +24,67 @@
 # SOFTWARE.
 
 from optparse import OptionParser
+import io
 import obo
 import sys
 
 
+# stanzas rendered in memory between two writes to standard output
+FLUSH_STANZAS = 10000
+
+
 class OBOSubtree(OptionParser):
     def __init__(self):
         OptionParser.__init__(self, usage='usage: %prog [options]')
         self.add_option('--exclude-root', action='append', dest='excluded_roots', help='exclude (remove) the specified term and descendents')
         self.add_option('--include-root', action='append', dest='included_roots', help='include (keep) the specified term and descendents')
         self.add_option('--default-exclude', action='store_true', default=False, dest='default_exclude', help='exclude by default if there is no specification for a term or ancestor')
+        self.add_option('--cache-dir', action='store', dest='cache_dir', default=None, help='cache parsed ontologies in this directory (default: no cache)')
 
-    def _is_excluded(self, default_exclude, excluded_roots, included_roots, excluded_terms, included_terms, term):
-        if term in excluded_terms:
-            return True
-        if term in included_terms:
-            return False
-        if term.id.value in included_roots:
-            included_terms.add(term)
-            return False
-        if term.id.value in excluded_roots:
-            excluded_terms.add(term)
-            return True
-        if 'is_a' not in term.references:
-            if default_exclude:
+    def _excluded_terms(self, onto, default_exclude, excluded_roots, included_roots):
+        # terms are decided once all their parents are, so each term is visited once
+        children = {}
+        waiting = {}
+        ready = []
+        for term in onto.iterterms():
+            id = term.id.value
+            if id in included_roots or id in excluded_roots or not term.references.get('is_a'):
+                ready.append(term)
+                continue
+            links = term.references['is_a']
+            waiting[term] = len(links)
+            for link in links:
+                children.setdefault(link.reference_object, []).append(term)
+        excluded_terms = set()
+        while ready:
+            term = ready.pop()
+            id = term.id.value
+            if id in included_roots:
+                excluded = False
+            elif id in excluded_roots:
+                excluded = True
+            elif 'is_a' not in term.references:
+                excluded = default_exclude
+            else:
+                excluded = all((link.reference_object in excluded_terms) for link in term.references['is_a'])
+            if excluded:
                 excluded_terms.add(term)
-                return True
-            included_terms.add(term)
-            return False
-        for link in term.references['is_a']:
-            if not self._is_excluded(default_exclude, excluded_roots, included_roots, excluded_terms, included_terms, link.reference_object):
-                included_terms.add(term)
-                return False
-        excluded_terms.add(term)
-        return True
+            for child in children.get(term, ()):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    ready.append(child)
+        return excluded_terms
 
-    def run(self):
-        options, args = self.parse_args()
+    def _load_onto(self, filenames):
         onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
+        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *filenames)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
+        return onto
+
+    def run(self):
+        options, args = self.parse_args()
+        onto = obo.load_cached(options.cache_dir, args, lambda: self._load_onto(args))
 
         if options.excluded_roots is None:
             excluded_roots = set()
@@ -74,21 +94,30 @@ class OBOSubtree(OptionParser):
             included_roots = set()
         else:
             included_roots = set(options.included_roots)
-        excluded_terms = set()
-        included_terms = set()
+        excluded_terms = self._excluded_terms(onto, options.default_exclude, excluded_roots, included_roots)
+        referrers = {}
         for term in onto.iterterms():
-            self._is_excluded(options.default_exclude, excluded_roots, included_roots, excluded_terms, included_terms, term)
-        for term in onto.iterterms():
-            for link_type in term.references:
-                term.references[link_type][:] = [link for link in term.references[link_type] if link.reference_object not in excluded_terms]
+            for link_type, links in term.references.items():
+                for link in links:
+                    referrers.setdefault(link.reference_object, []).append((term, link_type))
+        # only rebuild the link lists that point to an excluded term
+        dirty = set()
+        for term in excluded_terms:
+            dirty.update(referrers.get(term, ()))
+        for term, link_type in dirty:
+            term.references[link_type][:] = [link for link in term.references[link_type] if link.reference_object not in excluded_terms]
         for term in excluded_terms:
             del onto.stanzas[term.id.value]
 
-        onto.write_obo(sys.stdout)
-        for stanza in onto.stanzas.values():
-            if isinstance(stanza, obo.BuiltinStanza) or stanza.source == '<<builtin>>':
-                continue
-            stanza.write_obo(sys.stdout)
+        buf = io.StringIO()
+        onto.write_obo(buf)
+        for n, stanza in enumerate(onto.iter_user_stanzas(), 1):
+            stanza.write_obo(buf)
+            if n % FLUSH_STANZAS == 0:
+                sys.stdout.write(buf.getvalue())
+                buf.seek(0)
+                buf.truncate()
+        sys.stdout.write(buf.getvalue())
 
 
 if __name__ == '__main__':
@@ -25,13 +25,13 @@
 
 import re
 import sys
-import io
+import os
 import collections
 import functools
-
-
-def cmp(a, b):
-    return (a > b) - (a < b)
+import inspect
+import gc
+import hashlib
+import pickle
 
 
 class OBOException(Exception):
@@ -94,7 +94,7 @@ class UnhandledTagRecord(UnhandledTagOption):
         tagset.unhandled_tags.append((tag, value))
 
 
-class UnhadledTagWarnAndRecord(UnhandledTagWarn, UnhandledTagRecord):
+class UnhandledTagWarnAndRecord(UnhandledTagWarn, UnhandledTagRecord):
     '''Unhandled tag: print warning and record in 'unhandled_tags' '''
     def __init__(self):
         UnhandledTagWarn.__init__(self)
@@ -105,6 +105,10 @@ class UnhadledTagWarnAndRecord(UnhandledTagWarn, UnhandledTagRecord):
         UnhandledTagRecord.handle(self, tagset, tag, value)
 
 
+# former misspelled name
+UnhadledTagWarnAndRecord = UnhandledTagWarnAndRecord
+
+
 class UnhandledTagIgnore(UnhandledTagOption):
     '''Unhandled tag: silently ignore'''
     def __init__(self):
@@ -187,6 +191,8 @@ class DeprecatedTagSilent(DeprecatedTagOption):
 
 
 class TagReader:
+    _dispatch = {}
+
     def __init__(self, tagset, ontology, unhandled_tag_option, deprecated_tag_option):
         self.tagset = tagset
         self.ontology = ontology
@@ -194,12 +200,31 @@ class TagReader:
         self.unhandled_tag_option = unhandled_tag_option
         self.deprecated_tag_option = deprecated_tag_option
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # tag -> read method (None if unhandled), filled lazily for spellings mixing '-' and '_'
+        cls._dispatch = {}
+        for name in dir(cls):
+            if name.startswith('read_'):
+                fn = inspect.getattr_static(cls, name)
+                if isinstance(fn, functools.partialmethod) and not fn.args:
+                    # call the reader with its bound keywords directly, without the partialmethod wrapper
+                    fn = functools.partial(fn.func, **fn.keywords)
+                else:
+                    fn = getattr(cls, name)
+                cls._dispatch[name[5:]] = fn
+                cls._dispatch[name[5:].replace('_', '-')] = fn
+
     def read(self, tag, value):
-        method_name = 'read_' + tag.replace('-', '_')
-        if hasattr(self, method_name):
-            getattr(self, method_name)(value)
+        dispatch = self._dispatch
+        if tag in dispatch:
+            fn = dispatch[tag]
         else:
+            fn = dispatch[tag] = getattr(type(self), 'read_' + tag.replace('-', '_'), None)
+        if fn is None:
             self.default_read(tag, value)
+        else:
+            fn(self, value)
 
     def default_read(self, tag, value):
         value.warning('unhandled tag ' + tag + ' in ' + self.tagset.__class__.__name__)
@@ -213,26 +238,40 @@ def unquoted_string(name, phrase=False):
 
 
 def quoted_string(name):
-    return r'"(?P<' + name + r'>.*?)(?<!\\)"'
+    # jump from quote to quote instead of testing the closing quote after every character
+    return r'"(?P<' + name + r'>[^"\n]*(?:"[^"\n]*)*?)(?<!\\)"'
 
 
 TERMINAL_COMMENT = r'\s*(?:!.*)?$'
 SCOPE = r'(?:\s+(?P<scope>EXACT|BROAD|NARROW|RELATED))?'
 DBXREF_LIST = r'(?:\s+\[(?P<dbxrefs>(?:[^\[\]]|\\.)*)\])?'
 
-DATE_VALUE_PATTERN = re.compile(r'(?P<date>\d\d:\d\d:\d\d\d\d \d\d:\d\d)' + TERMINAL_COMMENT)
-SUBSETDEF_PATTERN = re.compile(unquoted_string('subset') + r'\s+' + quoted_string('descr') + TERMINAL_COMMENT)
-SYNONYMTYPEDEF_PATTERN = re.compile(unquoted_string('name') + r'\s+' + quoted_string('descr') + SCOPE + TERMINAL_COMMENT)
-FREE_VALUE_PATTERN = re.compile(r'(?P<value>(?:\\.|[^!\[\]])+)' + DBXREF_LIST + TERMINAL_COMMENT)
-BOOLEAN_VALUE_PATTERN = re.compile(r'(?P<value>true|false)' + TERMINAL_COMMENT)
-QUOTED_VALUE_PATTERN = re.compile(quoted_string('value') + TERMINAL_COMMENT)
-SYNONYM_PATTERN = re.compile(quoted_string('text') + SCOPE + r'(?: ' + unquoted_string('type') + ')?' + DBXREF_LIST + TERMINAL_COMMENT)
-DEPRECATED_SYNONYM_PATTERN = re.compile(quoted_string('text') + r'(?: ' + unquoted_string('type') + ')?' + DBXREF_LIST + TERMINAL_COMMENT)
-XREF_PATTERN = re.compile(unquoted_string('id') + r'(?: ' + quoted_string('descr') + r')?' + r'(?:\s+' + r'(?P<match>NO MATCH|MATCH NAME|MATCH SYNONYM)(?:\s+' + unquoted_string('matched', True) + r')?)?' + TERMINAL_COMMENT)
-INTERSECTION_PATTERN = re.compile('(?:' + unquoted_string('rel') + ' )?' + unquoted_string('id') + TERMINAL_COMMENT)
-RELATIONSHIP_PATTERN = re.compile(unquoted_string('rel') + r'\s+' + unquoted_string('id') + TERMINAL_COMMENT)
-INSTANCE_PROPERTY_VALUE_PATTERN = re.compile(unquoted_string('rel') + '(?: ' + quoted_string('value') + ')?' + r'\s+' + unquoted_string('ref') + TERMINAL_COMMENT)
-DEFINITION_PATTERN = re.compile(quoted_string('definition') + DBXREF_LIST + TERMINAL_COMMENT)
+
+class LazyPattern:
+    '''Regular expression compiled on first use'''
+    def __init__(self, pattern, flags=0):
+        self._source = (pattern, flags)
+
+    def __getattr__(self, name):
+        # store the attribute of the compiled pattern so that the next lookups do not get here
+        value = getattr(re.compile(*self._source), name)
+        setattr(self, name, value)
+        return value
+
+
+DATE_VALUE_PATTERN = LazyPattern(r'(?P<date>\d\d:\d\d:\d\d\d\d \d\d:\d\d)' + TERMINAL_COMMENT)
+SUBSETDEF_PATTERN = LazyPattern(unquoted_string('subset') + r'\s+' + quoted_string('descr') + TERMINAL_COMMENT)
+SYNONYMTYPEDEF_PATTERN = LazyPattern(unquoted_string('name') + r'\s+' + quoted_string('descr') + SCOPE + TERMINAL_COMMENT)
+FREE_VALUE_PATTERN = LazyPattern(r'(?P<value>(?:\\.|[^!\[\]])+)' + DBXREF_LIST + TERMINAL_COMMENT)
+BOOLEAN_VALUE_PATTERN = LazyPattern(r'(?P<value>true|false)' + TERMINAL_COMMENT)
+QUOTED_VALUE_PATTERN = LazyPattern(quoted_string('value') + TERMINAL_COMMENT)
+SYNONYM_PATTERN = LazyPattern(quoted_string('text') + SCOPE + r'(?: ' + unquoted_string('type') + ')?' + DBXREF_LIST + TERMINAL_COMMENT)
+DEPRECATED_SYNONYM_PATTERN = LazyPattern(quoted_string('text') + r'(?: ' + unquoted_string('type') + ')?' + DBXREF_LIST + TERMINAL_COMMENT)
+XREF_PATTERN = LazyPattern(unquoted_string('id') + r'(?: ' + quoted_string('descr') + r')?' + r'(?:\s+' + r'(?P<match>NO MATCH|MATCH NAME|MATCH SYNONYM)(?:\s+' + unquoted_string('matched', True) + r')?)?' + TERMINAL_COMMENT)
+INTERSECTION_PATTERN = LazyPattern('(?:' + unquoted_string('rel') + ' )?' + unquoted_string('id') + TERMINAL_COMMENT)
+RELATIONSHIP_PATTERN = LazyPattern(unquoted_string('rel') + r'\s+' + unquoted_string('id') + TERMINAL_COMMENT)
+INSTANCE_PROPERTY_VALUE_PATTERN = LazyPattern(unquoted_string('rel') + '(?: ' + quoted_string('value') + ')?' + r'\s+' + unquoted_string('ref') + TERMINAL_COMMENT)
+DEFINITION_PATTERN = LazyPattern(quoted_string('definition') + DBXREF_LIST + TERMINAL_COMMENT)
 
 
 def match_pattern(pattern, tag, value):
@@ -242,25 +281,27 @@ def match_pattern(pattern, tag, value):
     return result
 
 
+ESCAPE_PATTERN = LazyPattern(r'\\(.?)', re.DOTALL)
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+
+def _unescape_char(m):
+    c = m.group(1)
+    return ESCAPES.get(c, c)
+
+
 def unescape(s):
-    sl = []
-    esc = False
-    for c in s:
-        if esc:
-            if c == 'n':
-                sl.append('\n')
-            elif c == 't':
-                sl.append('\t')
-            elif c == 'r':
-                sl.append('\r')
-            else:
-                sl.append(c)
-            esc = False
-        elif c == '\\':
-            esc = True
-        else:
-            sl.append(c)
-    return ''.join(sl)
+    if '\\' not in s:
+        return s
+    return ESCAPE_PATTERN.sub(_unescape_char, s)
+
+
+def escape(s, quote=False):
+    # str.replace() returns s itself when there is nothing to replace, most values go through without a copy
+    s = s.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\n').replace('\t', '\\t').replace('[', '\\[').replace(']', '\\]').replace('{', '\\{').replace('}', '\\}')
+    if quote:
+        return '"%s"' % s.replace('"', '\\"')
+    return s
 
 
 def get_quoted_value(tag, value):
@@ -272,6 +313,10 @@ def get_boolean_value(tag, value):
 
 
 def get_free_value(tag, value):
+    v = value.value
+    # without brackets, comment or escapes the pattern would match the whole value
+    if v and '[' not in v and ']' not in v and '!' not in v and '\\' not in v:
+        return v.strip()
     return match_pattern(FREE_VALUE_PATTERN, tag, value).group('value').strip()
 
 
@@ -281,17 +326,20 @@ def get_date_value(tag, value):
 
 
 class Sourced:
+    __slots__ = ('source', 'lineno')
+
     def __init__(self, source, lineno):
         self.source = source
         self.lineno = lineno
 
+    # source and lineno are reassigned on reused readers, so the prefix is not cached
     def message(self, msg=None):
         if msg:
-            return '%s:%d: %s' % (self.source, self.lineno, msg)
-        return '%s:%d' % (self.source, self.lineno)
+            return f'{self.source}:{self.lineno}: {msg}'
+        return f'{self.source}:{self.lineno}'
 
     def warning(self, msg):
-        sys.stderr.write(self.message(msg + '\n'))
+        sys.stderr.write(f'{self.source}:{self.lineno}: {msg}\n')
 
     def duplicate(self, tag, msg=None):
         r = 'duplicate tag ' + tag + ', see: ' + self.message()
@@ -301,12 +349,18 @@ class Sourced:
 
 
 class SourcedValue(Sourced):
+    __slots__ = ('value',)
+
     def __init__(self, source, lineno, value):
-        Sourced.__init__(self, source, lineno)
+        # one per parsed line, Sourced.__init__ is inlined
+        self.source = source
+        self.lineno = lineno
         self.value = value
 
 
 class SubsetDef(Sourced):
+    __slots__ = ('name', 'description')
+
     def __init__(self, source, lineno, name, description):
         Sourced.__init__(self, source, lineno)
         self.name = name
@@ -314,6 +368,8 @@ class SubsetDef(Sourced):
 
 
 class SynonymTypeDef(Sourced):
+    __slots__ = ('name', 'description', 'scope')
+
     def __init__(self, source, lineno, name, description, scope):
         Sourced.__init__(self, source, lineno)
         self.name = name
@@ -375,6 +431,11 @@ class StanzaReader(Sourced, TagReader):
         self.stanza_type = stanza_type
         self.stanza = None
         self.invalid_xref_option = invalid_xref_option
+        # ontology tables looked up for every stanza or synonym
+        self._stanzas = ontology.stanzas
+        self._builtin = ontology.builtin
+        self._subsetdef = ontology.subsetdef
+        self._synonymtypedef = ontology.synonymtypedef
 
     def read(self, tag, value):
         if tag != 'id' and self.stanza is None:
@@ -384,12 +445,12 @@ class StanzaReader(Sourced, TagReader):
     def read_id(self, value):
         if self.stanza is not None:
             raise OBOException(value, self.stanza.duplicate('id'))
-        id = get_free_value('id', value)
-        if id in self.ontology.builtin:
+        id = sys.intern(get_free_value('id', value))
+        if id in self._builtin:
             raise OBOException(value, 'this id is reserved')
         srcid = SourcedValue(value.source, value.lineno, id)
-        if id in self.ontology.stanzas:
-            stanza = self.ontology.stanzas[id]
+        stanza = self._stanzas.get(id)
+        if stanza is not None:
             if not isinstance(stanza, self.stanza_type):
                 raise OBOException(value, 'the same id is used for different types of stanzas, see: ' + stanza.message())
             stanza.id = srcid
@@ -450,7 +511,7 @@ class StanzaReader(Sourced, TagReader):
         StanzaReference(value.source, value.lineno, self.stanza, rel, id)
 
     def read_namespace(self, value):
-        self.stanza.namespace = get_free_value('namespace', value)
+        self.stanza.namespace = sys.intern(get_free_value('namespace', value))
 
     def read_consider(self, value):
         id = get_free_value('consider', value)
@@ -462,13 +523,17 @@ class StanzaReader(Sourced, TagReader):
         if type is None:
             default_scope = 'RELATED'
         else:
-            if type not in self.ontology.synonymtypedef:
+            type = sys.intern(type)
+            typedef = self._synonymtypedef.get(type)
+            if typedef is None:
                 raise OBOException(value, 'undefined synonym type: ' + type)
-            default_scope = self.ontology.synonymtypedef[type].scope
+            default_scope = typedef.scope
         text = unescape(m.group('text'))
         scope = m.group('scope')
         if scope is None:
             scope = default_scope
+        else:
+            scope = sys.intern(scope)
         dbxrefs = m.group('dbxrefs')
         Synonym(value.source, value.lineno, self.stanza, text, scope, type, dbxrefs)
 
@@ -493,36 +558,32 @@ class TermOrTypeReader(StanzaReader):
         StanzaReader.__init__(self, source, lineno, stanza_type, ontology, unhandled_tag_option, deprecated_tag_option, invalid_xref_option)
 
     def read_subset(self, value):
-        subset = get_free_value('subset', value)
-        if subset not in self.ontology.subsetdef:
-            raise OBOException(value, 'undefined subset ' + subset + ' (' + str(self.ontology.subsetdef) + ')')
+        subset = sys.intern(get_free_value('subset', value))
+        subsetdef = self._subsetdef
+        if subset not in subsetdef:
+            raise OBOException(value, 'undefined subset ' + subset + ' (' + str(subsetdef) + ')')
         if subset in self.stanza.subsets:
-            value.warning(self.ontology.subsetdef[subset].duplicate('subsetdef'))
+            value.warning(subsetdef[subset].duplicate('subsetdef'))
         self.stanza.subsets.add(subset)
 
-    def _read_deprecated_synonym(self, tag, value, scope):
+    def _read_deprecated_synonym(self, value, tag, scope):
         self.deprecated_tag_option.handle(self.ontology, tag, value)
         m = match_pattern(DEPRECATED_SYNONYM_PATTERN, tag, value)
         type_ = m.group('type')
         if type_ is not None:
-            if type_ not in self.ontology.synonymtypedef:
+            type_ = sys.intern(type_)
+            typedef = self._synonymtypedef.get(type_)
+            if typedef is None:
                 raise OBOException(value, 'undefined synonym type: ' + type_)
-            scope = self.ontology.synonymtypedef[type_].scope
+            scope = typedef.scope
         text = m.group('text')
         dbxrefs = m.group('dbxrefs')
         Synonym(value.source, value.lineno, self.stanza, text, scope, type_, dbxrefs)
 
-    def read_exact_synonym(self, value):
-        self._read_deprecated_synonym('exact_synonym', value, 'EXACT')
-
-    def read_narrow_synonym(self, value):
-        self._read_deprecated_synonym('narrow_synonym', value, 'NARROW')
-
-    def read_related_synonym(self, value):
-        self._read_deprecated_synonym('related_synonym', value, 'RELATED')
-
-    def read_broad_synonym(self, value):
-        self._read_deprecated_synonym('broad_synonym', value, 'BROAD')
+    read_exact_synonym = functools.partialmethod(_read_deprecated_synonym, tag='exact_synonym', scope='EXACT')
+    read_narrow_synonym = functools.partialmethod(_read_deprecated_synonym, tag='narrow_synonym', scope='NARROW')
+    read_related_synonym = functools.partialmethod(_read_deprecated_synonym, tag='related_synonym', scope='RELATED')
+    read_broad_synonym = functools.partialmethod(_read_deprecated_synonym, tag='broad_synonym', scope='BROAD')
 
     def read_xref_analog(self, value):
         self._read_xref('xref_analog', value)
@@ -601,28 +662,24 @@ class TypedefReader(TermOrTypeReader):
 
 
 class StanzaReference(Sourced):
+    __slots__ = ('stanza', 'rel', 'reference', 'value', 'rel_object', 'reference_object')
+
     def __init__(self, source, lineno, stanza, rel, reference, collection_attribute='references'):
         Sourced.__init__(self, source, lineno)
         self.stanza = stanza
-        self.rel = rel
-        self.reference = reference
-        c = getattr(stanza, collection_attribute)
-        if rel in c:
-            lst = c[rel]
-        else:
-            lst = []
-            c[rel] = lst
-#        for ref in l:
-#            if ref.reference == reference:
-#                return
-        lst.append(self)
+        # a handful of relation names shared by every link
+        self.rel = rel = sys.intern(rel)
+        # the same ids are referenced from many stanzas and are keys of Ontology.stanzas
+        self.reference = sys.intern(reference)
+        getattr(stanza, collection_attribute)[rel].append(self)
 
     def resolve_reference(self, rel_object, dangling_reference_option, obsolete_reference_option):
         if rel_object is not None:
             self.rel_object = rel_object
-        if self.reference in self.stanza.ontology.stanzas:
-            self.reference_object = self.stanza.ontology.stanzas[self.reference]
-            if obsolete_reference_option is not None and self.reference_object.is_obsolete:
+        reference_object = self.stanza.ontology.stanzas.get(self.reference)
+        if reference_object is not None:
+            self.reference_object = reference_object
+            if obsolete_reference_option is not None and reference_object.is_obsolete:
                 obsolete_reference_option.handle(self, self.reference, 'reference to obsolete ')
                 # XXX check range
         else:
@@ -630,6 +687,8 @@ class StanzaReference(Sourced):
 
 
 class XRef(Sourced):
+    __slots__ = ('term', 'reference', 'description', 'match', 'matched', '_escaped_value')
+
     def __init__(self, source, lineno, term, reference, description, match, matched):
         Sourced.__init__(self, source, lineno)
         self.term = term
@@ -637,10 +696,25 @@ class XRef(Sourced):
         self.description = description
         self.match = match
         self.matched = matched
+        self._escaped_value = None
         term.xref.append(self)
 
+    def escaped_value(self):
+        '''Returns the escaped xref value, computed again only if one of its parts was replaced'''
+        cache = self._escaped_value
+        if cache is None or cache[0] is not self.reference or cache[1] is not self.match or cache[2] is not self.matched:
+            value = self.reference
+            if self.match:
+                value = value + ' ' + self.match
+            if self.matched:
+                value = value + ' ' + self.matched
+            cache = self._escaped_value = (self.reference, self.match, self.matched, escape(value))
+        return cache[3]
+
 
 class Synonym(Sourced):
+    __slots__ = ('stanza', 'text', 'scope', 'type', 'dbxrefs', 'type_object', '_escaped_text')
+
     def __init__(self, source, lineno, stanza, text, scope, type, dbxrefs):
         Sourced.__init__(self, source, lineno)
         self.stanza = stanza
@@ -648,8 +722,16 @@ class Synonym(Sourced):
         self.scope = scope
         self.type = type
         self.dbxrefs = dbxrefs
+        self._escaped_text = None
         stanza.synonyms.append(self)
 
+    def escaped_text(self):
+        '''Returns the quoted and escaped synonym text, computed again only if text was replaced'''
+        cache = self._escaped_text
+        if cache is None or cache[0] is not self.text:
+            cache = self._escaped_text = (self.text, escape(self.text, quote=True))
+        return cache[1]
+
     def resolve_references(self, dangling_reference_option):
         if self.type is None:
             return
@@ -658,7 +740,10 @@ class Synonym(Sourced):
             return
         self.type_object = self.stanza.ontology.synonymtypedef[self.type]
 
+
 class TagSet:
+    __slots__ = ()
+
     def __init__(self):
         self.unhandled_tags = []
 
@@ -669,11 +754,11 @@ class TagSet:
         if hasattr(self, attr):
             self._write_obo_triplet(out, pred, getattr(self, attr), comment=comment, quote=quote, scope=scope, dbxrefs=dbxrefs)
 
-    def _write_obo_triplet(self, out, pred, value, comment=None, quote=False, scope=None, dbxrefs=None):
-        if hasattr(value, '__iter__') and type(value) is not str:
-            for v in value:
-                self._write_obo_triplet(out, pred, v, comment=comment, quote=quote, scope=scope, dbxrefs=dbxrefs)
-            return
+    def _write_obo_triplet_list(self, out, pred, values):
+        for v in values:
+            self._write_obo_triplet(out, pred, v)
+
+    def _write_obo_triplet(self, out, pred, value, comment=None, quote=False, scope=None, dbxrefs=None, escaped=False):
         if hasattr(value, 'id'):
             value = value.id
         if hasattr(value, 'value'):
@@ -684,17 +769,16 @@ class TagSet:
             value = 'true'
         if value is False:
             return
-        value = value.replace('\n', '\\n').replace('\r', '\\n').replace('\t', '\\t').replace('\\', '\\\\').replace('[', '\\[').replace(']', '\\]').replace('{', '\\{').replace('}', '\\}')
-        if quote:
-            value = '"%s"' % value.replace('"', '\\"')
+        if not escaped:
+            value = escape(value, quote)
         if scope:
             value = '%s %s' % (value, scope)
         if dbxrefs is not None:
             value = '%s [%s]' % (value, dbxrefs)
-        out.write('%s: %s' % (pred, value))
-        if comment is not None:
-            out.write(' ! %s' % comment)
-        out.write('\n')
+        if comment is None:
+            out.write('%s: %s\n' % (pred, value))
+        else:
+            out.write('%s: %s ! %s\n' % (pred, value, comment))
 
 
 class BuiltinStanza:
@@ -702,6 +786,7 @@ class BuiltinStanza:
         self.ontology = ontology
         self.id = id
         self.ontology.stanzas[id] = self
+        self.ontology._terms = None
         self.ontology.builtin[id] = self
 
     def resolve_references(self, dangling_reference_option, obsolete_reference_option):
@@ -738,30 +823,31 @@ class BuiltinInstance(BuiltinStanza):
         self.is_obsolete = False
 
 
-@functools.cmp_to_key
-def _reference_relation_comparator(a, b):
-    if a == b:
-        return 0
-    if a == 'is_a':
-        return -1
-    if b == 'is_a':
-        return 1
-    return cmp(a, b)
+def _reference_relation_key(rel):
+    # is_a first, then other relations in alphabetical order
+    if rel == 'is_a':
+        return (0, '')
+    return (1, rel)
 
 
 class Stanza(Sourced, TagSet):
+    __slots__ = ('unhandled_tags', 'ontology', 'id', 'name', 'is_anonymous', 'alt_ids', 'comment', 'synonyms', '_synonym_index', '_reference_indexes', 'references', 'is_obsolete', 'created_by', 'creation_date', 'definition', 'definition_dbxrefs', 'xref', 'replaced_by', 'consider', 'namespace')
+
     def __init__(self, source, lineno, ontology, id):
         Sourced.__init__(self, source, lineno)
         TagSet.__init__(self)
         self.ontology = ontology
         self.id = id
         ontology.stanzas[id.value] = self
+        ontology._terms = None
         self.name = None
         self.is_anonymous = False
         self.alt_ids = []
         self.comment = None
         self.synonyms = []
-        self.references = {}
+        self._synonym_index = None
+        self._reference_indexes = None
+        self.references = collections.defaultdict(list)
         self.is_obsolete = False
         self.created_by = None
         self.creation_date = None
@@ -773,28 +859,35 @@ class Stanza(Sourced, TagSet):
         self.namespace = ontology.default_namespace
 
     def lookup_synonym(self, text, remove=False):
-        for s in self.synonyms:
-            if s.text == text:
-                if remove:
-                    self.synonyms[:] = [x for x in self.synonyms if x.text != text]
-                return s
-        return None
+        # text -> position of the first synonym, checked on each hit since scripts edit synonyms in place
+        syns = self.synonyms
+        index = self._synonym_index
+        i = None if index is None else index.get(text)
+        if i is None or i >= len(syns) or syns[i].text != text:
+            for i, s in enumerate(syns):
+                if s.text == text:
+                    break
+            else:
+                return None
+            index = self._synonym_index = {}
+            for n, s in enumerate(syns):
+                index.setdefault(s.text, n)
+        s = syns[i]
+        if remove:
+            syns[:] = [x for x in syns if x.text != text]
+            self._synonym_index = None
+        return s
 
     def _write_obo_synonyms(self, out):
         for syn in self.synonyms:
-            self._write_obo_triplet(out, 'synonym', syn.text, comment=None, quote=True, scope=syn.scope, dbxrefs=syn.dbxrefs)
+            self._write_obo_triplet(out, 'synonym', syn.escaped_text(), scope=syn.scope, dbxrefs=syn.dbxrefs, escaped=True)
 
     def _write_obo_xrefs(self, out):
         for x in self.xref:
-            value = x.reference
-            if x.match:
-                value = value + ' ' + x.match
-            if x.matched:
-                value = value + ' ' + x.matched
-            self._write_obo_triplet(out, 'xref', value)
+            self._write_obo_triplet(out, 'xref', x.escaped_value(), escaped=True)
 
     def _write_obo_relations(self, out):
-        for refrel in sorted(self.references, key=_reference_relation_comparator):
+        for refrel in sorted(self.references, key=_reference_relation_key):
             for ref in self.references[refrel]:
                 if hasattr(ref, 'reference_object') and hasattr(ref.reference_object, 'name'):
                     comment = ref.reference_object.name.value
@@ -812,9 +905,9 @@ class Stanza(Sourced, TagSet):
         out.write('\n[%s]\n' % self.obo_header())
         self._write_obo_triplet(out, 'id', self.id)
         self._write_obo_triplet(out, 'name', self.name)
-        self._write_obo_triplet(out, 'alt_id', self.alt_ids)
+        self._write_obo_triplet_list(out, 'alt_id', self.alt_ids)
         self._write_obo_triplet(out, 'def', self.definition, quote=True, dbxrefs=self.definition_dbxrefs)
-        self._write_obo_triplet_attr(out, 'subset', 'subsets')
+        self._write_obo_triplet_list(out, 'subset', getattr(self, 'subsets', ()))
         self._write_obo_triplet_attr(out, 'is_transitive', 'is_transitive')
         self._write_obo_triplet(out, 'comment', self.comment)
         self._write_obo_synonyms(out)
@@ -822,8 +915,8 @@ class Stanza(Sourced, TagSet):
         self._write_obo_relations(out)
         self._write_obo_triplet(out, 'is_anonymous', self.is_anonymous)
         self._write_obo_triplet(out, 'is_obsolete', self.is_obsolete)
-        self._write_obo_triplet(out, 'replaced_by', self.replaced_by)
-        self._write_obo_triplet(out, 'consider', self.consider)
+        self._write_obo_triplet_list(out, 'replaced_by', self.replaced_by)
+        self._write_obo_triplet_list(out, 'consider', self.consider)
         self._write_obo_triplet(out, 'created_by', self.created_by)
         self._write_obo_triplet(out, 'creation_date', self.creation_date)
 
@@ -834,12 +927,12 @@ class Stanza(Sourced, TagSet):
     def _resolve_relation_references(self, c, dangling_reference_option, obsolete_reference_option):
         if self.is_obsolete:
             obsolete_reference_option = None
+        stanzas = self.ontology.stanzas
         for rt, refs in c.items():
-            if rt not in self.ontology.stanzas:
+            rt_object = stanzas.get(rt)
+            if rt_object is None:
                 dangling_reference_option.handle(self, rt)
-                rt_object = None
             else:
-                rt_object = self.ontology.stanzas[rt]
                 if not isinstance(rt_object, Typedef):
                     raise OBOException('this is not a relation type: ' + rt + '\n    ' + '\n    '.join(ref.message() for ref in refs))
                 # XXX check domain
@@ -853,13 +946,30 @@ class Stanza(Sourced, TagSet):
 
     def lookup_reference(self, rel, reference, collection_attribute='references', remove=False):
         c = getattr(self, collection_attribute)
-        if rel in c:
-            for r in c[rel]:
+        if rel not in c:
+            return None
+        links = c[rel]
+        # same as lookup_synonym(), reference -> position of the first link, one index per link list
+        indexes = self._reference_indexes
+        if indexes is None:
+            indexes = self._reference_indexes = {}
+        key = (collection_attribute, rel)
+        index = indexes.get(key)
+        i = None if index is None else index.get(reference)
+        if i is None or i >= len(links) or links[i].reference != reference:
+            for i, r in enumerate(links):
                 if r.reference == reference:
-                    if remove:
-                        c[rel][:] = [x for x in c[rel] if r.reference != reference]
-                    return r
-        return None
+                    break
+            else:
+                return None
+            index = indexes[key] = {}
+            for n, r in enumerate(links):
+                index.setdefault(r.reference, n)
+        r = links[i]
+        if remove:
+            links[:] = [x for x in links if x.reference != reference]
+            del indexes[key]
+        return r
 
     def parents(self, rel='is_a'):
         if rel in self.references:
@@ -867,41 +977,103 @@ class Stanza(Sourced, TagSet):
                 yield link.reference_object
 
     def children(self, rel='is_a'):
+        if self.ontology._children_indexes is not None:
+            yield from self.ontology.children_index(rel).get(self, ())
+            return
         for stanza in self.ontology.stanzas.values():
             if isinstance(stanza, BuiltinStanza):
                 continue
-            for p in stanza.parents():
-                if p.id.value == self.id.value:
+            for link in stanza.references.get(rel, ()):
+                if getattr(link, 'reference_object', None) is self:
                     yield stanza
                     break
 
     def ancestors(self, rel='is_a', include_self=False):
         if include_self:
             yield self
-        if rel in self.references:
-            for link in self.references[rel]:
-                for a in link.reference_object.ancestors(rel, include_self=True):
-                    yield a
+        yield from self._ancestors(rel)
+
+    def _ancestors(self, rel):
+        # every parent followed by its own ancestors, once per path as the recursive walk did
+        cache = self.ontology._ancestors_cache
+        if cache is None:
+            cache = {}
+        key = (self, rel)
+        if key in cache:
+            return cache[key]
+        stack = [self]
+        expanded = set()
+        while stack:
+            s = stack[-1]
+            if (s, rel) in cache:
+                stack.pop()
+                continue
+            parents = [link.reference_object for link in s.references.get(rel, ())]
+            missing = [p for p in parents if (p, rel) not in cache]
+            if missing:
+                if s in expanded:
+                    raise OBOException(s, 'cycle for %s (%s)?' % (s.id.value, s.name.value))
+                expanded.add(s)
+                stack.extend(missing)
+                continue
+            stack.pop()
+            r = []
+            for p in parents:
+                r.append(p)
+                r.extend(cache[(p, rel)])
+            cache[(s, rel)] = tuple(r)
+        return cache[key]
+
+    def first_path(self, rel='is_a', include_self=False):
+        '''Returns the first path yielded by paths() as a tuple, None if there is none'''
+        cache = self.ontology._first_paths
+        key = (self, rel)
+        if cache is not None and key in cache:
+            path = cache[key]
+        else:
+            # paths() walks depth-first, the first path only costs its own length
+            path = next(self.paths(rel, include_self=True), None)
+            if path is not None:
+                path = tuple(path)
+            if cache is not None:
+                cache[key] = path
+        if path is None or include_self:
+            return path
+        return path[:-1]
 
     def paths(self, rel='is_a', include_self=False):
-        try:
-            if rel in self.references:
-                for link in self.references[rel]:
-                    for parent_path in link.reference_object.paths(rel, include_self=True):
-                        if self in parent_path:
-                            raise Exception('loop: %s <- %s' % (' <- '.join(str(p.id.value) for p in parent_path), str(self.id.value)))
-                        if include_self:
-                            parent_path.append(self)
-                        yield parent_path
-            elif include_self:
-                yield [self]
+        # depth-first from self to the roots, the stack holds the current path and the links left to follow
+        links = self.references.get(rel)
+        if links is None:
+            yield [self] if include_self else []
+            return
+        stack = [(self, iter(links))]
+        on_path = {self}
+        while stack:
+            s, links = stack[-1]
+            link = next(links, None)
+            if link is None:
+                stack.pop()
+                on_path.discard(s)
+                continue
+            parent = link.reference_object
+            if parent in on_path:
+                raise OBOException(parent, 'cycle for %s (%s)?' % (parent.id.value, parent.name.value))
+            parent_links = parent.references.get(rel)
+            if parent_links is None:
+                path = [parent]
+                path.extend(s for s, _ in reversed(stack))
+                if not include_self:
+                    path.pop()
+                yield path
             else:
-                yield []
-        except RuntimeError:
-            raise OBOException(self, 'cycle for %s (%s)?' % (self.id.value, self.name.value))
+                stack.append((parent, iter(parent_links)))
+                on_path.add(parent)
 
 
 class TermOrType(Stanza):
+    __slots__ = ('subsets', 'subset_objects')
+
     def __init__(self, source, lineno, ontology, id):
         Stanza.__init__(self, source, lineno, ontology, id)
         self.subsets = set()
@@ -917,9 +1089,11 @@ class TermOrType(Stanza):
 
 
 class Term(TermOrType):
+    __slots__ = ('intersection_of',)
+
     def __init__(self, source, lineno, ontology, id):
         TermOrType.__init__(self, source, lineno, ontology, id)
-        self.intersection_of = {}
+        self.intersection_of = collections.defaultdict(list)
 
     def resolve_references(self, dangling_reference_option, obsolete_reference_option):
         TermOrType.resolve_references(self, dangling_reference_option, obsolete_reference_option)
@@ -930,6 +1104,8 @@ class Term(TermOrType):
 
 
 class Typedef(TermOrType):
+    __slots__ = ('is_anti_symmetric', 'is_cyclic', 'is_metadata_tag', 'is_reflexive', 'is_symmetric', 'is_transitive')
+
     def __init__(self, source, lineno, ontology, id):
         TermOrType.__init__(self, source, lineno, ontology, id)
 
@@ -938,6 +1114,8 @@ class Typedef(TermOrType):
 
 
 class Instance(Stanza):
+    __slots__ = ()
+
     def __init__(self, source, lineno, ontology, id):
         Stanza.__init__(self, source, lineno, ontology, id)
 
@@ -988,8 +1166,8 @@ class DanglingReferenceWarnAndIgnore(DanglingReferenceWarn, DanglingReferenceIgn
         DanglingReferenceIgnore.handle(self, sourced, ref, msg)
 
 
-STANZA_TYPE_PATTERN = re.compile(r'\[(?P<stanza_type>\S+)\]' + TERMINAL_COMMENT)
-TAG_VALUE_PATTERN = re.compile('(?P<tag>(?:[^:]|\\.)+):(?P<value>.*)')
+STANZA_TYPE_PATTERN = LazyPattern(r'\[(?P<stanza_type>\S+)\]' + TERMINAL_COMMENT)
+TAG_VALUE_PATTERN = LazyPattern('(?P<tag>(?:[^:]|\\.)+):(?P<value>.*)')
 
 
 class OntologyReader:
@@ -1010,15 +1188,13 @@ class OntologyReader:
             r.unhandled_tag_option = unhandled_tag_option
             r.deprecated_tag_option = deprecated_tag_option
             r.invalid_xref_option = invalid_xref_option
-        lineno = 0
-        for line in file:
-            lineno += 1
+        intern = sys.intern
+        for lineno, line in enumerate(file, 1):
             line = line.strip()
-            if line == '':
-                continue
-            if line[0] == '!':
+            if not line or line[0] == '!':
                 continue
-            m = STANZA_TYPE_PATTERN.match(line)
+            # only stanza headers start with '[', other lines skip the pattern
+            m = STANZA_TYPE_PATTERN.match(line) if line[0] == '[' else None
             if m is not None:
                 stanza_type_name = m.group('stanza_type')
                 if stanza_type_name not in self.stanza_readers:
@@ -1028,12 +1204,35 @@ class OntologyReader:
                 current_reader.lineno = lineno
                 current_reader.stanza = None
                 continue
-            m = TAG_VALUE_PATTERN.match(line)
-            if m is None:
+            tag, sep, value = line.partition(':')
+            if '\\' in tag:
+                # the tag may contain an escaped colon
+                m = TAG_VALUE_PATTERN.match(line)
+                if m is None:
+                    raise OBOException(Sourced(source, lineno), 'syntax error')
+                tag = m.group('tag')
+                value = m.group('value')
+            elif not sep or not tag:
                 raise OBOException(Sourced(source, lineno), 'syntax error')
-            tag = m.group('tag').strip()
-            value = m.group('value').strip()
-            current_reader.read(tag, SourcedValue(source, lineno, value))
+            current_reader.read(intern(tag.strip()), SourcedValue(source, lineno, value.strip()))
+
+    def read_tag_lines(self, source, tag_lines, unhandled_tag_option, deprecated_tag_option, invalid_xref_option):
+        '''Reads already split (lineno, stanza type, tag, value) lines, stanza type is None for tag lines'''
+        current_reader = self.header_reader
+        current_reader.unhandled_tag_option = unhandled_tag_option
+        current_reader.deprecated_tag_option = deprecated_tag_option
+        for r in self.stanza_readers.values():
+            r.unhandled_tag_option = unhandled_tag_option
+            r.deprecated_tag_option = deprecated_tag_option
+            r.invalid_xref_option = invalid_xref_option
+        for lineno, stanza_type_name, tag, value in tag_lines:
+            if stanza_type_name is not None:
+                current_reader = self.stanza_readers[stanza_type_name]
+                current_reader.source = source
+                current_reader.lineno = lineno
+                current_reader.stanza = None
+            else:
+                current_reader.read(tag, SourcedValue(source, lineno, value))
 
 
 BUILTIN = u'''[Typedef]
@@ -1094,21 +1293,46 @@ def: "Indicates the domain (type of source) of a relation"
 '''
 
 
+_BUILTIN_TAG_LINES = []
+
+
+def _builtin_tag_lines():
+    '''Returns the lines of BUILTIN split once for every Ontology'''
+    if not _BUILTIN_TAG_LINES:
+        # BUILTIN only has stanza headers and plain tag lines
+        for lineno, line in enumerate(BUILTIN.split('\n'), 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '[':
+                _BUILTIN_TAG_LINES.append((lineno, line[1:-1], None, None))
+            else:
+                tag, _, value = line.partition(':')
+                _BUILTIN_TAG_LINES.append((lineno, None, sys.intern(tag.strip()), value.strip()))
+    return _BUILTIN_TAG_LINES
+
+
 class Ontology(TagSet):
     def __init__(self):
         TagSet.__init__(self)
-        self.synonymtypedef = collections.OrderedDict()
+        self.synonymtypedef = {}
         self.remark = []
-        self.stanzas = collections.OrderedDict()
+        self.stanzas = {}
         self.builtin = {}
-        self.subsetdef = collections.OrderedDict()
+        self.subsetdef = {}
         self.format_version = '1.2'
         self.version = None
         self.date = None
         self.saved_by = None
         self.auto_generated_by = None
         self.default_namespace = None
-        OntologyReader(self).read('<<builtin>>', io.StringIO(BUILTIN), UnhandledTagFail(), DeprecatedTagWarn(), InvalidXRefWarn())
+        # (stanza, rel) -> ancestors or first path, and rel -> children index, None unless cache_hierarchy() was called
+        self._ancestors_cache = None
+        self._first_paths = None
+        self._children_indexes = None
+        # (number of stanzas, terms), dropped whenever a stanza is created
+        self._terms = None
+        OntologyReader(self).read_tag_lines('<<builtin>>', _builtin_tag_lines(), UnhandledTagFail(), DeprecatedTagWarn(), InvalidXRefWarn())
         self.builtin_relations = set(r.id.value for r in self.stanzas.values() if (r.source == '<<builtin>>'))
         BuiltinType(self)
         BuiltinInstance(self)
@@ -1126,7 +1350,7 @@ class Ontology(TagSet):
         for syntype in self.synonymtypedef.values():
             self._write_obo_triplet(out, 'synonymtypedef', '%s "%s" %s' % (syntype.name, syntype.description, syntype.scope))
         self._write_obo_triplet(out, 'default-namespace', self.default_namespace)
-        self._write_obo_triplet(out, 'remark', self.remark)
+        self._write_obo_triplet_list(out, 'remark', self.remark)
 
     def load_files(self, unhandled_tag_option, deprecated_tag_option, invalid_xref_option, *filenames):
         reader = OntologyReader(self)
@@ -1140,17 +1364,55 @@ class Ontology(TagSet):
         reader.read('<<stdin>>', sys.stdin, unhandled_tag_option, deprecated_tag_option, invalid_xref_option)
 
     def resolve_references(self, dangling_reference_option, obsolete_reference_option):
+        self.clear_hierarchy_cache()
         for s in self.stanzas.values():
             s.resolve_references(dangling_reference_option, obsolete_reference_option)
 
+    def cache_hierarchy(self):
+        '''Keeps ancestors, first paths and children once computed, for ontologies whose links are not edited any more'''
+        if self._ancestors_cache is None:
+            self._ancestors_cache = {}
+            self._first_paths = {}
+            self._children_indexes = {}
+
+    def clear_hierarchy_cache(self):
+        '''Forgets ancestors, paths and children computed so far, to be called after links were added, removed or changed'''
+        if self._ancestors_cache is not None:
+            self._ancestors_cache = {}
+            self._first_paths = {}
+            self._children_indexes = {}
+
+    def children_index(self, rel='is_a'):
+        '''Returns a dict from each stanza to the list of its children through rel, in stanza order'''
+        indexes = self._children_indexes
+        index = None if indexes is None else indexes.get(rel)
+        if index is None:
+            index = {}
+            if indexes is not None:
+                indexes[rel] = index
+            for stanza in self.stanzas.values():
+                if isinstance(stanza, BuiltinStanza):
+                    continue
+                for link in stanza.references.get(rel, ()):
+                    parent = getattr(link, 'reference_object', None)
+                    if parent is None:
+                        continue
+                    children = index.setdefault(parent, [])
+                    # a child linked twice to the same parent is listed once
+                    if not children or children[-1] is not stanza:
+                        children.append(stanza)
+        return index
+
     def check_required(self):
         for s in self.stanzas.values():
             s.check_required()
 
     def iterterms(self):
-        for term in self.stanzas.values():
-            if isinstance(term, Term):
-                yield term
+        terms = self._terms
+        if terms is None or terms[0] != len(self.stanzas):
+            # a shorter stanzas dict means some were deleted
+            terms = self._terms = (len(self.stanzas), [s for s in self.stanzas.values() if isinstance(s, Term)])
+        return iter(terms[1])
 
     def iter_user_stanzas(self):
         for stanza in self.stanzas.values():
@@ -1159,6 +1421,38 @@ class Ontology(TagSet):
             yield stanza
 
 
+def cache_path(cache_dir, filenames):
+    '''Returns the cache file for filenames, keyed by their path, size and modification time'''
+    h = hashlib.sha1()
+    # pickles depend on the classes of this module as well
+    for fn in (__file__,) + tuple(filenames):
+        st = os.stat(fn)
+        h.update(('%s\t%d\t%d\n' % (os.path.abspath(fn), st.st_size, st.st_mtime_ns)).encode('utf-8'))
+    return os.path.join(cache_dir, h.hexdigest() + '.pickle')
+
+
+def load_cached(cache_dir, filenames, load):
+    '''Returns the ontology built by load(), pickled in cache_dir'''
+    if cache_dir is None:
+        return load()
+    path = cache_path(cache_dir, filenames)
+    if os.path.exists(path):
+        # the collector would repeatedly scan the many objects pickle allocates
+        gc.disable()
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        finally:
+            gc.enable()
+    onto = load()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(onto, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return onto
+
+
 if __name__ == '__main__':
     onto = Ontology()
     onto.load_stdin(UnhandledTagWarn(), DeprecatedTagWarn(), InvalidXRefWarn())
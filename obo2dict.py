@@ -23,14 +23,32 @@
 # SOFTWARE.
 
 from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor
 import obo
 import codecs
+import io
+import multiprocessing
+import re
+import sys
+
+
+FLUSH_ROWS = 10000
 
 
 class ValueMap(object):
+    __slots__ = ('item', 'stanza', '_first_id_paths', '_first_name_paths', '_subsets')
+
+    # pattern key -> key method, filled on first use of each key
+    _dispatch = {}
+
     def __init__(self):
         self.item = None
         self.stanza = None
+        # term -> first path strings, asked again for every synonym or xref of the term
+        self._first_id_paths = {}
+        self._first_name_paths = {}
+        # term -> subset, the same for every synonym or xref of the term
+        self._subsets = {}
 
     def set(self, value):
         (self.item, self.stanza) = value
@@ -38,10 +56,17 @@ class ValueMap(object):
     def __getitem__(self, key):
         if not isinstance(key, str):
             raise TypeError()
-        method = 'key_' + key.replace('-', '_')
-        if not hasattr(self, method):
-            raise KeyError(key)
-        return getattr(self, method)()
+        return self.key_method(key)(self)
+
+    @classmethod
+    def key_method(cls, key):
+        fn = cls._dispatch.get(key)
+        if fn is None:
+            fn = getattr(cls, 'key_' + key.replace('-', '_'), None)
+            if fn is None:
+                raise KeyError(key)
+            cls._dispatch[key] = fn
+        return fn
 
     def key_name(self):
         return self.stanza.name.value
@@ -68,66 +93,148 @@ class ValueMap(object):
         return '\t'.join(x.reference for x in self.stanza.xref)
 
     def key_subset(self):
-        for ancestor in self.stanza.ancestors(include_self=True):
+        subset = self._subsets.get(self.stanza)
+        if subset is None:
+            subset = self._subsets[self.stanza] = self._nearest_subset(self.stanza)
+        return subset
+
+    def _nearest_subset(self, stanza):
+        for ancestor in stanza.ancestors(include_self=True):
             if isinstance(ancestor, obo.TermOrType):
                 for subset in ancestor.subsets:
                     return subset
         return ''
 
+    def _first_id_path(self, term):
+        s = self._first_id_paths.get(term)
+        if s is None:
+            s = self._first_id_paths[term] = '/' + '/'.join([t.id.value for t in term.first_path(include_self=True)])
+        return s
+
+    def _first_name_path(self, term):
+        s = self._first_name_paths.get(term)
+        if s is None:
+            s = self._first_name_paths[term] = '/' + '/'.join([t.name.value for t in term.first_path(include_self=True)])
+        return s
+
     def key_id_path(self):
-        if isinstance(self.item, list):
-            return '/' + '/'.join(term.id.value for term in self.item)
+        if isinstance(self.item, (tuple, list)):
+            return '/' + '/'.join([term.id.value for term in self.item])
         if isinstance(self.item, obo.Term):
-            paths = list(self.item.paths(include_self=True))
-            return '/' + '/'.join(term.id.value for term in paths[0])
+            return self._first_id_path(self.item)
         if isinstance(self.item, obo.Synonym):
-            paths = list(self.item.stanza.paths(include_self=True))
-            return '/' + '/'.join(term.id.value for term in paths[0])
+            return self._first_id_path(self.item.stanza)
         if isinstance(self.item, obo.XRef):
-            paths = list(self.item.term.paths(include_self=True))
-            return '/' + '/'.join(term.id.value for term in paths[0])
+            return self._first_id_path(self.item.term)
         raise Exception('expected list, got ' + str(self.item))
 
     def key_name_path(self):
-        if isinstance(self.item, list):
-            return '/' + '/'.join(term.name.value for term in self.item)
+        if isinstance(self.item, (tuple, list)):
+            return '/' + '/'.join([term.name.value for term in self.item])
         if isinstance(self.item, obo.Term):
-            paths = list(self.item.paths(include_self=True))
-            return '/' + '/'.join(term.name.value for term in paths[0])
+            return self._first_name_path(self.item)
         raise Exception('expected list, got ' + str(self.item))
 
 
-def iter_terms(onto):
-    return ((term, term) for term in onto.stanzas.values() if isinstance(term, obo.Term))
+PATTERN_KEY = re.compile(r'%%|%\(([^)]*)\)')
+
+
+def compile_pattern(pattern):
+    '''Returns the pattern with positional directives and the ValueMap methods for its keys, None if it has directives without key'''
+    if '%' in PATTERN_KEY.sub('', pattern):
+        return None
+    keys = []
+
+    def positional(m):
+        if m.group(1) is None:
+            return m.group(0)
+        keys.append(m.group(1))
+        return '%'
+    fmt = PATTERN_KEY.sub(positional, pattern)
+    return fmt, tuple(ValueMap.key_method(key) for key in keys)
+
 
+def iter_terms(terms):
+    return ((term, term) for term in terms)
 
-def iter_term_synonyms(onto):
-    for term in onto.stanzas.values():
-        if isinstance(term, obo.Term):
-            yield term, term
-            for syn in term.synonyms:
-                yield syn, term
 
+def iter_term_synonyms(terms):
+    for term in terms:
+        yield term, term
+        for syn in term.synonyms:
+            yield syn, term
 
-def iter_term_parents(onto):
-    for term in onto.stanzas.values():
-        if isinstance(term, obo.Term):
-            for parent in term.parents():
-                yield parent, term
 
+def iter_term_parents(terms):
+    for term in terms:
+        for parent in term.parents():
+            yield parent, term
 
-def iter_term_paths(onto):
-    for term in onto.stanzas.values():
-        if isinstance(term, obo.Term):
-            for path in term.paths(include_self=True):
-                yield path, term
 
+def _term_paths(term, paths):
+    # same paths in the same order as term.paths(include_self=True), but each term's paths are built once
+    stack = [term]
+    expanded = set()
+    while stack:
+        t = stack[-1]
+        if t in paths:
+            stack.pop()
+            continue
+        links = t.references.get('is_a')
+        if links is None:
+            stack.pop()
+            paths[t] = ((t,),)
+            continue
+        parents = [link.reference_object for link in links]
+        missing = [p for p in parents if p not in paths]
+        if missing:
+            if t in expanded:
+                raise obo.OBOException(t, 'cycle for %s (%s)?' % (t.id.value, t.name.value))
+            expanded.add(t)
+            stack.extend(missing)
+            continue
+        stack.pop()
+        paths[t] = tuple((parent_path + (t,)) for p in parents for parent_path in paths[p])
+    return paths[term]
 
-def iter_term_xrefs(onto):
-    for term in onto.stanzas.values():
-        if isinstance(term, obo.Term):
-            for xref in term.xref:
-                yield xref, term
+
+def iter_term_paths(terms):
+    paths = {}
+    for term in terms:
+        for path in _term_paths(term, paths):
+            yield path, term
+
+
+def iter_term_xrefs(terms):
+    for term in terms:
+        for xref in term.xref:
+            yield xref, term
+
+
+def iter_rows(items, pattern):
+    '''Yields the output line of each item'''
+    map = ValueMap()
+    compiled = compile_pattern(pattern)
+    if compiled is None:
+        for value in items:
+            map.set(value)
+            yield pattern % map + '\n'
+    else:
+        # call the key methods directly rather than through ValueMap.__getitem__
+        fmt = compiled[0] + '\n'
+        fns = compiled[1]
+        for value in items:
+            map.set(value)
+            yield fmt % tuple([fn(map) for fn in fns])
+
+
+# (item iterator, pattern, terms), set before forking the workers so they inherit the ontology
+_job = None
+
+
+def _format_shard(bounds):
+    iter_items, pattern, terms = _job
+    return ''.join(iter_rows(iter_items(terms[bounds[0]:bounds[1]]), pattern))
 
 
 class OBO2Dict(OptionParser):
@@ -140,18 +247,40 @@ class OBO2Dict(OptionParser):
         self.add_option('--term-parents', action='store_const', dest='iter', const=iter_term_parents, help='iterates over term parents')
         self.add_option('--terms', action='store_const', dest='iter', const=iter_terms, help='iterates over terms')
         self.add_option('--pattern', action='store', type='string', dest='pattern', metavar='PATTERN', help='item output pattern (default: %default)')
+        self.add_option('--jobs', action='store', type='int', dest='jobs', default=1, help='format rows in this many processes (default: %default)')
 
     def run(self):
+        global _job
         options, args = self.parse_args()
         onto = obo.Ontology()
         onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        map = ValueMap()
+        onto.cache_hierarchy()
         pattern = options.pattern.replace('\\t', '\t')
-        for value in options.iter(onto):
-            map.set(value)
-            print(pattern % map)
+        if options.jobs <= 1:
+            # one row per item, gathered in a buffer rather than printed one by one
+            buf = io.StringIO()
+            try:
+                for n, row in enumerate(iter_rows(options.iter(onto.iterterms()), pattern), 1):
+                    buf.write(row)
+                    if n % FLUSH_ROWS == 0:
+                        sys.stdout.write(buf.getvalue())
+                        buf.seek(0)
+                        buf.truncate()
+            finally:
+                # rows formatted before an error are still printed
+                sys.stdout.write(buf.getvalue())
+            return
+        terms = list(onto.iterterms())
+        # a few shards per worker so that a slow shard does not hold the others back
+        n = options.jobs * 4
+        shards = [(len(terms) * i // n, len(terms) * (i + 1) // n) for i in range(n)]
+        _job = (options.iter, pattern, terms)
+        # workers are forked so that they share the loaded ontology, shards come back in order
+        with ProcessPoolExecutor(options.jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+            for rows in executor.map(_format_shard, shards):
+                sys.stdout.write(rows)
 
 
 if __name__ == '__main__':
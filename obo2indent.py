@@ -23,6 +23,7 @@
 # SOFTWARE.
 
 from optparse import OptionParser
+import collections
 import obo
 
 
@@ -35,29 +36,37 @@ class OBO2Indent(OptionParser):
     def run(self):
         options, args = self.parse_args()
         onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagSilent(), *args)
+        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagSilent(), obo.InvalidXRefWarn(), *args)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        if options.root is None:
-            for t in onto.iterterms():
-                if 'is_a' not in t.references:
-                    self.display(onto, t, '')
-        else:
-            self.display(onto, onto.stanzas[options.root], '')
-
-    def display(self, onto, term, indent):
-        print(indent + '----------')
-        print(indent + term.id.value)
-        print(indent + term.name.value)
-        for syn in term.synonyms:
-            print(indent + syn.text)
-        print(indent + '----------')
-        indent = indent + '\t'
+        # parent -> children, once per is_a link, instead of scanning all terms for each displayed term
+        children = collections.defaultdict(list)
+        roots = []
         for t in onto.iterterms():
             if 'is_a' in t.references:
                 for link in t.references['is_a']:
-                    if link.reference_object == term:
-                        self.display(onto, t, indent)
+                    children[link.reference_object].append(t)
+            else:
+                roots.append(t)
+        if options.root is None:
+            for t in roots:
+                self.display(onto, t, '', children)
+        else:
+            self.display(onto, onto.stanzas[options.root], '', children)
+
+    def display(self, onto, term, indent, children):
+        # depth-first with an explicit stack, children are pushed in reverse to come out in order
+        stack = [(term, indent)]
+        while stack:
+            term, indent = stack.pop()
+            print(indent + '----------')
+            print(indent + term.id.value)
+            print(indent + term.name.value)
+            for syn in term.synonyms:
+                print(indent + syn.text)
+            print(indent + '----------')
+            indent = indent + '\t'
+            stack.extend((t, indent) for t in reversed(children.get(term, ())))
 
 
 if __name__ == '__main__':
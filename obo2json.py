@@ -24,7 +24,9 @@
 
 import json
 from optparse import OptionParser
+import collections
 import obo
+import sys
 
 
 class OBO2Indent(OptionParser):
@@ -39,60 +41,73 @@ class OBO2Indent(OptionParser):
         onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
+        # parent -> children, once per is_a link, instead of scanning all terms for each displayed term
+        children = collections.defaultdict(list)
+        roots = []
+        for t in onto.iterterms():
+            if 'is_a' in t.references:
+                for link in t.references['is_a']:
+                    children[link.reference_object].append(t)
+            else:
+                roots.append(t)
         if options.root is None:
-            for t in onto.iterterms():
-                if 'is_a' not in t.references:
-                    nbSubLevel, nbDescendant, displayStr = self.display(onto, t, '')
-                    print(displayStr)
+            for t in roots:
+                nbSubLevel, nbDescendant = self.display(onto, t, '', children, sys.stdout.write)
+                sys.stdout.write('\n')
         else:
-            nbSubLevel, nbDescendant, displayStr = self.display(onto, onto.stanzas[options.root], '')
-            print(displayStr)
+            nbSubLevel, nbDescendant = self.display(onto, onto.stanzas[options.root], '', children, sys.stdout.write)
+            sys.stdout.write('\n')
 
-    def display(self, onto, term, indent):
-        resultStr = indent + '{'
-        resultStr += '"extid" : ' + json.dumps(term.id.value) + ', ' + "\n"
-        resultStr += indent + '"intid" : ' + json.dumps(term.id.value) + ', ' + "\n"
-        resultStr += indent + '"name" : ' + json.dumps(term.name.value)
+    def _enter(self, term, indent, children, write):
+        write(indent + '{')
+        write('"extid" : ' + json.dumps(term.id.value) + ', ' + "\n")
+        write(indent + '"intid" : ' + json.dumps(term.id.value) + ', ' + "\n")
+        write(indent + '"name" : ' + json.dumps(term.name.value))
 
         synonymes = []
         for syn in term.synonyms:
             if len(syn.text) > 0:
                 synonymes.append(syn.text)
         if len(synonymes):
-            resultStr += ', ' + "\n"
-            resultStr += indent + '"syns" : ' + json.dumps(synonymes)
-
-        childrenStr = ''
-        sepChild = ''
-        innerIndent = indent + '\t'
-        nbDescendant = 0
-        nbSubLevel = 0
-        for t in onto.iterterms():
-            if 'is_a' in t.references:
-                for link in t.references['is_a']:
-                    if link.reference_object == term:
-                        nbDescendant += 1
-                        childrenStr += innerIndent + sepChild + "\n"
-                        nbChildSubLevel, nbChildChildren, childStr = self.display(onto, t, innerIndent)
-                        childrenStr += childStr
-                        nbDescendant += nbChildChildren
-                        nbSubLevel = max(nbSubLevel, nbChildSubLevel)
-                        sepChild = ', '
+            write(', ' + "\n")
+            write(indent + '"syns" : ' + json.dumps(synonymes))
 
-        if len(childrenStr) > 0:
-            resultStr += ', ' + "\n"
-            resultStr += indent + '"children" :[' + "\n" + childrenStr
-            resultStr += indent + '] '
+        termChildren = children.get(term, ())
+        if termChildren:
+            write(', ' + "\n")
+            write(indent + '"children" :[' + "\n")
+        # term, indent, children, next child, number of descendants, number of sub levels
+        return [term, indent, termChildren, 0, 0, 0]
 
-            resultStr += ', ' + "\n"
-            resultStr += indent + '"descendantnb" : ' + str(nbDescendant)
-            resultStr += ', ' + "\n"
-            resultStr += indent + '"sublevelnb" : ' + str(nbSubLevel)
+    def display(self, onto, term, indent, children, write):
+        '''Writes the subtree of term as it is walked, returns its number of levels and of descendants'''
+        # the terms being displayed from term down to the current one, counts are summed when a term is left
+        stack = [self._enter(term, indent, children, write)]
+        while True:
+            frame = stack[-1]
+            term, indent, termChildren, n, nbDescendant, nbSubLevel = frame
+            if n < len(termChildren):
+                frame[3] = n + 1
+                innerIndent = indent + '\t'
+                write(innerIndent + (', ' if n > 0 else '') + "\n")
+                stack.append(self._enter(termChildren[n], innerIndent, children, write))
+                continue
+            stack.pop()
+            if termChildren:
+                write(indent + '] ')
 
-            resultStr += "\n"
-            resultStr += indent + '}' + "\n"
+                write(', ' + "\n")
+                write(indent + '"descendantnb" : ' + str(nbDescendant))
+                write(', ' + "\n")
+                write(indent + '"sublevelnb" : ' + str(nbSubLevel))
 
-        return nbSubLevel + 1, nbDescendant, resultStr
+                write("\n")
+                write(indent + '}' + "\n")
+            if not stack:
+                return nbSubLevel + 1, nbDescendant
+            parent = stack[-1]
+            parent[4] += 1 + nbDescendant
+            parent[5] = max(parent[5], nbSubLevel + 1)
 
 
 if __name__ == '__main__':
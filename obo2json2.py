@@ -40,39 +40,37 @@ class OBO2Json(argparse.ArgumentParser):
         ontology.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args.obo_files)
         ontology.check_required()
         ontology.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        terms = {}
+        children = {}
         for term in ontology.iterterms():
-            terms[term.id.value] = {
-                'extid': term.id.value,
-                'intid': term.id.value,
-                'name': term.name.value,
-                'syns': [syn.text for syn in term.synonyms],
-                'children': []
-            }
-        for term in ontology.iterterms():
-            d = terms[term.id.value]
             if 'is_a' in term.references:
                 for link in term.references['is_a']:
-                    parent_d = terms[link.reference]
-                    parent_d['children'].append(d)
-        root_d = terms[args.root]
-        self._desc(root_d)
-        self._sublvl(root_d)
-        json.dump(root_d, sys.stdout)
-
-    def _desc(self, d):
-        r = sum((self._desc(c) + 1) for c in d['children'])
-        d['descendantnb'] = r
-        return r
+                    children.setdefault(link.reference_object, []).append(term)
+        self._dump(ontology.stanzas[args.root], children, sys.stdout.write)
 
-    def _sublvl(self, d):
-        if len(d['children']) == 0:
-            r = 0
-        else:
-            r = 1 + max(self._sublvl(c) for c in d['children'])
-        d['sublevelnb'] = r
-        return r
+    def _dump(self, root, children, write):
+        '''Writes the subtree of root as json.dump() would write nested term dicts, without building them'''
+        # [children, next child, number of descendants, number of sub levels] for the terms being written
+        stack = [self._open(root, children, write)]
+        while True:
+            frame = stack[-1]
+            term_children, n, desc, sublvl = frame
+            if n < len(term_children):
+                frame[1] = n + 1
+                if n > 0:
+                    write(', ')
+                stack.append(self._open(term_children[n], children, write))
+                continue
+            stack.pop()
+            write('], "descendantnb": %d, "sublevelnb": %d}' % (desc, sublvl))
+            if not stack:
+                return
+            parent = stack[-1]
+            parent[2] += desc + 1
+            parent[3] = max(parent[3], sublvl + 1)
 
+    def _open(self, term, children, write):
+        write('{"extid": %s, "intid": %s, "name": %s, "syns": %s, "children": [' % (json.dumps(term.id.value), json.dumps(term.id.value), json.dumps(term.name.value), json.dumps([syn.text for syn in term.synonyms])))
+        return [children.get(term, ()), 0, 0, 0]
 
 if __name__ == '__main__':
     OBO2Json().run()
@@ -46,26 +46,11 @@ def _get_value(v):
     return v
 
 
-def stanza_comparator(attr):
-    def result(a, b):
-        twa = stanza_type_weight(a)
-        twb = stanza_type_weight(b)
-        if attr is None or twa != twb:
-            return twa - twb
-        aa = _get_value(getattr(a, attr))
-        ab = _get_value(getattr(b, attr))
-        if aa == ab:
-            return 0
-        if aa < ab:
-            return -1
-        return 1
-    return result
-
-
 def stanza_sort_key(attr):
     if attr is None:
         return stanza_type_weight
-    return lambda x: (stanza_type_weight(x), getattr(x, attr, x))
+    # compare values rather than SourcedValue objects, builtin stanzas have no name
+    return lambda x: (stanza_type_weight(x), _get_value(getattr(x, attr, None)))
 
 
 class OBO2OBO(OptionParser):
@@ -91,7 +76,6 @@ class OBO2OBO(OptionParser):
         onto.write_obo(stdout)
         stanzas = list(onto.stanzas.values())
         stanzas.sort(key=stanza_sort_key(options.sort_by))
-        # stanzas.sort(cmp=stanza_comparator(options.sort_by))
         synonym_sources = set(args[i] for i in options.synonyms_from)
         isa_sources = set(args[i] for i in options.isa_from)
         name_sources = set(args[i] for i in options.name_from)
@@ -22,11 +22,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 import obo
+import sys
 from optparse import OptionParser
 from xml.sax.saxutils import escape
 
 
+FLUSH_TERMS = 10000
+
+
 OWL_HEADER = '''<?xml version="1.0"?>
 <rdf:RDF
     xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
@@ -39,6 +44,13 @@ OWL_FOOTER = '''</rdf:RDF>
 '''
 
 
+def _escape(s):
+    # most labels have nothing to escape, skip the three replace() calls for them
+    if '&' in s or '<' in s or '>' in s:
+        return escape(s)
+    return s
+
+
 class OBO2OWL(OptionParser):
     def __init__(self):
         OptionParser.__init__(self, usage='usage: %prog [options]')
@@ -53,29 +65,41 @@ class OBO2OWL(OptionParser):
         onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceWarn())
-        print(OWL_HEADER)
-        for stanza in onto.stanzas.values():
-            if isinstance(stanza, obo.Term):
-                print('  <owl:Class rdf:about="%s">' % self._id(stanza.id.value))
-                print('    <rdfs:label rdf:datatype="http://www.w3.org/2001/XMLSchema#string">%s</rdfs:label>' % escape(stanza.name.value))
-                if options.synonyms:
-                    for syn in stanza.synonyms:
-                        if syn.scope == 'EXACT':
-                            tag = 'synonymExact'
-                        elif syn.scope == 'RELATED':
-                            tag = 'synonymRelated'
-                        elif syn.scope == 'NARROW':
-                            tag = 'synonymNarrower'
-                        else:
-                            raise RuntimeError(syn.scope)
-                        print('    <%s rdf:datatype="http://www.w3.org/2001/XMLSchema#string">%s</%s>' % (tag, escape(syn.text), tag))
-                if 'is_a' in stanza.references:
-                    for ref in stanza.references['is_a']:
-                        print('    <rdfs:subClassOf>')
-                        print('      <owl:Class rdf:about="%s"/>' % self._id(ref.reference))
-                        print('    </rdfs:subClassOf>')
-                print('  </owl:Class>')
-        print(OWL_FOOTER)
+        # one write per line into a buffer rather than one print per line
+        buf = io.StringIO()
+        write = buf.write
+        try:
+            write(OWL_HEADER + '\n')
+            n = 0
+            for stanza in onto.stanzas.values():
+                if isinstance(stanza, obo.Term):
+                    write('  <owl:Class rdf:about="%s">\n' % self._id(stanza.id.value))
+                    write('    <rdfs:label rdf:datatype="http://www.w3.org/2001/XMLSchema#string">%s</rdfs:label>\n' % _escape(stanza.name.value))
+                    if options.synonyms:
+                        for syn in stanza.synonyms:
+                            if syn.scope == 'EXACT':
+                                tag = 'synonymExact'
+                            elif syn.scope == 'RELATED':
+                                tag = 'synonymRelated'
+                            elif syn.scope == 'NARROW':
+                                tag = 'synonymNarrower'
+                            else:
+                                raise RuntimeError(syn.scope)
+                            write('    <%s rdf:datatype="http://www.w3.org/2001/XMLSchema#string">%s</%s>\n' % (tag, _escape(syn.text), tag))
+                    if 'is_a' in stanza.references:
+                        for ref in stanza.references['is_a']:
+                            write('    <rdfs:subClassOf>\n')
+                            write('      <owl:Class rdf:about="%s"/>\n' % self._id(ref.reference))
+                            write('    </rdfs:subClassOf>\n')
+                    write('  </owl:Class>\n')
+                    n += 1
+                    if n % FLUSH_TERMS == 0:
+                        sys.stdout.write(buf.getvalue())
+                        buf.seek(0)
+                        buf.truncate()
+            write(OWL_FOOTER + '\n')
+        finally:
+            sys.stdout.write(buf.getvalue())
 
 
 if __name__ == '__main__':
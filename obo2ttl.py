@@ -22,9 +22,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import io
 import obo
+import sys
 from optparse import OptionParser
 
+
+FLUSH_TERMS = 10000
+
+
 PREFIXES = {
     'rdfs': 'http://www.w3.org/2000/01/rdf-schema#',
     'owl': 'http://www.w3.org/2002/07/owl#',
@@ -40,7 +46,18 @@ def _prefix_callback(option, opt_str, value, parser):
         PREFIXES[name] = prefix
 
 
+_ids = {}
+
+
 def _get_id(options, id):
+    # the same parents are referenced by many terms, options and PREFIXES do not change once arguments are parsed
+    r = _ids.get(id)
+    if r is None:
+        r = _ids[id] = _prefixed_id(options, id)
+    return r
+
+
+def _prefixed_id(options, id):
     if options.terms_namespace:
         return '%s:%s' % (options.terms_namespace, id)
     for name, prefix in PREFIXES.items():
@@ -50,13 +67,11 @@ def _get_id(options, id):
 
 
 def _term_statements(options, t):
-    yield 'skos:prefLabel "%s"^^xsd:string' % t.name.value
-    for syn in t.synonyms:
-        yield 'skos:altLabel "%s"^^xsd:string' % syn.text
+    statements = ['skos:prefLabel "%s"^^xsd:string' % t.name.value]
+    statements.extend(['skos:altLabel "%s"^^xsd:string' % syn.text for syn in t.synonyms])
     if 'is_a' in t.references:
-        for link in t.references['is_a']:
-            p = link.reference_object
-            yield 'rdfs:subClassOf %s' % _get_id(options, p.id.value)
+        statements.extend(['rdfs:subClassOf %s' % _get_id(options, link.reference_object.id.value) for link in t.references['is_a']])
+    return statements
 
 
 class OBO2TTL(OptionParser):
@@ -68,16 +83,23 @@ class OBO2TTL(OptionParser):
     def run(self):
         options, args = self.parse_args()
         onto = obo.Ontology()
-        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), *args)
+        onto.load_files(obo.UnhandledTagFail(), obo.DeprecatedTagWarn(), obo.InvalidXRefWarn(), *args)
         onto.check_required()
         onto.resolve_references(obo.DanglingReferenceFail(), obo.DanglingReferenceFail())
-        for p in PREFIXES.items():
-            print('@prefix %s: <%s> .' % p)
-        print
-        for t in onto.iterterms():
-            print(_get_id(options, t.id.value))
-            print(' ;\n'.join(_term_statements(options, t)))
-            print('.\n')
+        # one write per term into a buffer rather than three prints
+        buf = io.StringIO()
+        write = buf.write
+        try:
+            for p in PREFIXES.items():
+                write('@prefix %s: <%s> .\n' % p)
+            for n, t in enumerate(onto.iterterms(), 1):
+                write('%s\n%s\n.\n\n' % (_get_id(options, t.id.value), ' ;\n'.join(_term_statements(options, t))))
+                if n % FLUSH_TERMS == 0:
+                    sys.stdout.write(buf.getvalue())
+                    buf.seek(0)
+                    buf.truncate()
+        finally:
+            sys.stdout.write(buf.getvalue())
 
 
 if __name__ == '__main__':
@@ -32,20 +32,30 @@ class Wang_Normalization(dict):
         self.ontology = ontology
         self.weight = weight
 
-    def _ancestors(self, term, depth):
-        yield term, depth
-        if 'is_a' in term.references:
-            for r in term.references['is_a']:
-                for p in self._ancestors(r.reference_object, depth + 1):
-                    yield p
-
     def _get_s_values(self, term):
+        # shortest is_a distance to each ancestor, breadth-first
+        depths = {term: 0}
+        level = [term]
+        depth = 0
+        while level:
+            depth += 1
+            next_level = []
+            for t in level:
+                for r in t.references.get('is_a', ()):
+                    p = r.reference_object
+                    if p not in depths:
+                        depths[p] = depth
+                        next_level.append(p)
+            level = next_level
+        # keep the order in which a depth-first walk first reaches each ancestor
         result = {}
-        for ancestor, depth in self._ancestors(term, 0):
-            if ancestor in result:
-                result[ancestor] = min(result[ancestor], depth)
-            else:
-                result[ancestor] = depth
+        stack = [term]
+        while stack:
+            t = stack.pop()
+            if t in result:
+                continue
+            result[t] = depths[t]
+            stack.extend(r.reference_object for r in reversed(t.references.get('is_a', ())))
         return result
 
     def value(self, term):